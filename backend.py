@@ -1,17 +1,151 @@
-from bottle import Bottle, run, response, request
+from bottle import Bottle, ServerAdapter, run, response, request
+import argparse
+import importlib.util
 import json
+import signal
+import socketserver
+import wsgiref.simple_server
+import bank
+import cache
+import compression
 import db
+import exam
+import grading
+import sandbox
+import search
+import serializer
+import writer
 from mcOption import MCOption
 from rubric import Rubric
 from setup import Setup
 from question import Question
 
 app = Bottle()
+app.install(db.ConnectionPlugin())
+app.uninstall('json')
+app.install(serializer.JSONPlugin())
+
+db.migrate()
 
 MCOption.setupBottleRoutes(app)
 Rubric.setupBottleRoutes(app)
 Setup.setupBottleRoutes(app)
 Question.setupBottleRoutes(app)
+bank.setupBottleRoutes(app)
+cache.setupBottleRoutes(app)
+search.setupBottleRoutes(app)
+exam.setupBottleRoutes(app)
+grading.setupBottleRoutes(app)
+
+# What the server runs: the app with its responses compressed
+application = compression.Compressor(app)
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+    '''wsgiref's server handling every request in its own thread. Closing it
+       waits for the requests still running.'''
+    daemon_threads = False
+    block_on_close = True
+
+
+class GunicornServer(ServerAdapter):
+    '''Bottle's gunicorn adapter, configured only from its options. Bottle's
+       own builds on gunicorn's command line Application, which parses
+       sys.argv again and fails on this launcher's flags.'''
+
+    def run(self, handler):
+        from gunicorn.app.base import BaseApplication
+
+        config = {'bind': f'{self.host}:{int(self.port)}'}
+        config.update(self.options)
+
+        class GunicornApplication(BaseApplication):
+            def load_config(self):
+                for key, value in config.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return handler
+
+        GunicornApplication().run()
+
+
+# Servers in the order --server auto tries them. The stdlib one is always there.
+SERVERS = ('gunicorn', 'waitress', 'threading')
+# Bottle adapters of the servers that don't use Bottle's own by their name
+ADAPTERS = {'gunicorn': GunicornServer, 'threading': 'wsgiref'}
+
+
+def pickServer(name):
+    '''Returns the server to run, picking the first installed one for auto'''
+    if name != 'auto':
+        return name
+    for server in SERVERS:
+        if server == 'threading' or importlib.util.find_spec(server) is not None:
+            return server
+
+
+def serverOptions(server, args):
+    '''Translates the command line into the options of Bottle's adapter'''
+    if server == 'gunicorn':
+        # Pre-forked worker processes. Each one opens its own connections,
+        # see ConnectionPool.
+        return {'workers': args.workers, 'keepalive': args.keep_alive,
+                'graceful_timeout': args.graceful_timeout}
+    if server == 'waitress':
+        return {'threads': args.workers, 'channel_timeout': args.keep_alive}
+    # wsgiref speaks HTTP/1.0, so there is no keep-alive and one thread per request
+    return {'server_class': ThreadingWSGIServer}
+
+
+def stop(signum, frame):
+    # Bottle's run() returns on KeyboardInterrupt, which lets the server
+    # finish its requests and the pool close its connections
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the exam question backend.')
+    parser.add_argument('--server', choices=('auto',) + SERVERS, default='auto',
+                        help='HTTP server, auto picks the first installed of gunicorn and waitress (default: auto)')
+    parser.add_argument('--bind', default='localhost:8080', help='host:port to listen on (default: localhost:8080)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='gunicorn worker processes or waitress threads (default: 4)')
+    parser.add_argument('--keep-alive', type=int, default=5,
+                        help='seconds an idle keep-alive connection is kept open (default: 5)')
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds gunicorn workers get to finish their requests on shutdown (default: 30)')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='serve GET requests from a copy of the database kept at PATH')
+    parser.add_argument('--snapshot-interval', type=float, default=db.SNAPSHOT_INTERVAL,
+                        help=f'seconds between refreshes of the snapshot (default: {db.SNAPSHOT_INTERVAL})')
+    parser.add_argument('--group-commit', action='store_true',
+                        help='commit concurrent writes together on one writer thread')
+    parser.add_argument('--group-latency', type=float, default=writer.MAX_LATENCY * 1000,
+                        help=f'milliseconds a group waits for more writes (default: {writer.MAX_LATENCY * 1000:g})')
+    parser.add_argument('--group-size', type=int, default=writer.BATCH_SIZE,
+                        help=f'most writes committed together (default: {writer.BATCH_SIZE})')
+    parser.add_argument('--sql-workers', type=int, default=sandbox.WORKERS,
+                        help=f'processes grading SQL submissions in parallel (default: {sandbox.WORKERS})')
+    parser.add_argument('--debug', action='store_true', help="Bottle's debug mode and the request log")
+    args = parser.parse_args()
+
+    host, _, port = args.bind.rpartition(':')
+    server = pickServer(args.server)
+    signal.signal(signal.SIGTERM, stop)
+    if args.snapshot:
+        db.configureReads(args.snapshot, args.snapshot_interval)
+    if args.group_commit:
+        writer.configure(True, args.group_latency / 1000, args.group_size)
+    sandbox.configure(args.sql_workers)
+
+    # Start the backend
+    run(application, server=ADAPTERS.get(server, server), host=host or 'localhost', port=int(port),
+        debug=args.debug, quiet=not args.debug, **serverOptions(server, args))
+    writer.configure(False)
+    sandbox.stop()
+    app.close()
+
 
-# Start the backend
-run(app, host='localhost', port=8080, debug=True)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+import codecs
+import csv
+import itertools
+import json
+import db
+import etag
+import serializer
+from bottle import BaseRequest, response, request
+from mcOption import MCOption
+from question import Question
+from rubric import Rubric
+
+# Import and export of whole question banks. An import body is read straight
+# from wsgi.input in chunks instead of through request.json, which buffers it
+# and rejects anything over MEMFILE_MAX, so only one batch of records is in
+# memory at once. Exports are streamed the same way in the other direction.
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+
+
+def readChunks(environ, size=CHUNK_SIZE):
+    '''Yields the raw request body in chunks of at most size bytes'''
+    read = environ['wsgi.input'].read
+    if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+        yield from BaseRequest._iter_chunked(read, size)
+        return
+
+    remaining = int(environ.get('CONTENT_LENGTH') or 0)
+    while remaining > 0:
+        chunk = read(min(remaining, size))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def readLines(chunks):
+    '''Decodes UTF-8 byte chunks and yields them as lines, each ending in \\n
+       except possibly the last'''
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    for chunk in chunks:
+        *lines, pending = (pending + decoder.decode(chunk)).split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def ndjsonRecords(lines):
+    '''Yields (line number, question dict) for every non blank line. A line
+       that isn't valid JSON is yielded with the exception instead.'''
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as err:
+            yield number, Exception(f'Invalid JSON: {err}')
+
+
+def csvRecords(lines):
+    '''Yields (line number, question dict) for every row of a CSV file whose
+       header names the question columns: type, question_text, points, setup
+       and answer. A row that can't be converted is yielded with the
+       exception instead.'''
+    reader = csv.DictReader(lines)
+    for row in reader:
+        try:
+            record = {key: (value if value != '' else None) for key, value in row.items() if key is not None}
+            if record.get('points') is not None:
+                points = float(record['points'])
+                record['points'] = int(points) if points.is_integer() else points
+            if record.get('setup') is not None:
+                record['setup'] = int(record['setup'])
+            yield reader.line_num, record
+        except ValueError as err:
+            yield reader.line_num, Exception(f'Invalid value: {err}')
+
+
+def importQuestions(records, batch_size=DEFAULT_BATCH_SIZE):
+    '''Creates a question from each (line number, question dict) record,
+       committing once per batch_size records. Yields an {"error": ...} for
+       every record that fails, a {"progress": ...} after every commit and
+       finally a {"done": ...} with the totals.'''
+    imported = failed = batches = 0
+    records = iter(records)
+    while True:
+        # Read the batch before starting the transaction, so the write lock
+        # isn't held while waiting on the client
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            break
+
+        errors = []
+        with db.transaction() as conn:
+            cursor = conn.cursor()
+            for line, record in batch:
+                if isinstance(record, Exception):
+                    errors.append({'line': line, 'error': str(record)})
+                    continue
+                cursor.execute("SAVEPOINT record")
+                try:
+                    if not isinstance(record, dict):
+                        raise Exception(f'Expected a JSON object.')
+                    Question.insert(cursor, record)
+                    cursor.execute("RELEASE record")
+                except Exception as err:
+                    cursor.execute("ROLLBACK TO record")
+                    cursor.execute("RELEASE record")
+                    error = f'Missing field: {err.args[0]}' if isinstance(err, KeyError) else str(err)
+                    errors.append({'line': line, 'error': error})
+
+        batches += 1
+        failed += len(errors)
+        imported += len(batch) - len(errors)
+        for error in errors:
+            yield {'error': error}
+        yield {'progress': {'line': batch[-1][0], 'imported': imported, 'failed': failed}}
+
+    yield {'done': {'imported': imported, 'failed': failed, 'batches': batches}}
+
+
+def _childRows(cursor):
+    '''Returns a function that, called with question ids in ascending order,
+       returns the rows of cursor, which must be ordered by qid, belonging to
+       each of them'''
+    groups = itertools.groupby(cursor, key=lambda row: row['qid'])
+    current = next(groups, None)
+
+    def rowsOf(qid):
+        nonlocal current
+        # Skip the rows of questions that no longer exist
+        while current is not None and current[0] < qid:
+            current = next(groups, None)
+        if current is None or current[0] != qid:
+            return []
+        rows, current = list(current[1]), next(groups, None)
+        return rows
+    return rowsOf
+
+
+def exportDocuments():
+    '''Yields the document of every question in id order, with its setup
+       embedded as {"id", "setup_text"} instead of an id. Question, MCOption
+       and Rubric are each read by one cursor in question id order and
+       merged as they go, so no table is ever held in memory.'''
+    pool = db.readers
+    conn = pool.acquire()
+    try:
+        # One read transaction so all three cursors see the same snapshot
+        conn.execute("BEGIN")
+        questions = conn.execute("""SELECT Question.*, Setup.setup_text FROM Question
+                                    LEFT JOIN Setup ON Setup.id = Question.setup
+                                    ORDER BY Question.id""")
+        optionsOf = _childRows(conn.execute("SELECT * FROM MCOption WHERE qid IS NOT NULL ORDER BY qid, is_true, id"))
+        rubricsOf = _childRows(conn.execute("SELECT * FROM Rubric WHERE qid IS NOT NULL ORDER BY qid, id"))
+
+        for row in questions:
+            question = Question(row['id'], row['type'], row['question_text'], row['points'], row['setup'], row['answer'])
+            options = [MCOption(option['id'], bool(option['is_true']), option['option_text'], option['qid'])
+                       for option in optionsOf(question.id)]
+            rubrics = [Rubric(rubric['id'], rubric['rubric_text'], rubric['points'], rubric['qid'])
+                       for rubric in rubricsOf(question.id)]
+            document = question.jsonable(options, rubrics)
+            if question.setup is not None:
+                document['setup'] = {'id': question.setup, 'setup_text': row['setup_text']}
+            yield document
+    finally:
+        pool.release(conn)
+
+
+def _buffered(strings, size=CHUNK_SIZE):
+    '''Joins strings into chunks of about size characters for the server'''
+    buffer, length = [], 0
+    for string in strings:
+        buffer.append(string)
+        length += len(string)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def exportJSON(documents):
+    '''Yields documents as the text of one JSON array'''
+    yield '['
+    for i, document in enumerate(documents):
+        yield (', ' if i else '') + serializer.dumps(document)
+    yield ']'
+
+
+def exportNDJSON(documents):
+    '''Yields documents as NDJSON, one per line'''
+    for document in documents:
+        yield serializer.dumps(document) + '\n'
+
+
+def setupBottleRoutes(app):
+    @app.post('/import')
+    def postImport():
+        '''Imports questions from an NDJSON body, one question object per line
+           as for POST /question, or from CSV with ?format=csv or Content-Type
+           text/csv. Responds with an NDJSON stream of errors and progress.'''
+        ctype = request.content_type.split(';')[0]
+        format = request.query.get('format') or ('csv' if ctype == 'text/csv' else 'ndjson')
+        try:
+            batch_size = int(request.query.get('batch', DEFAULT_BATCH_SIZE))
+        except ValueError:
+            batch_size = 0
+        if (format not in ('ndjson', 'csv')):
+            response.status = 400
+            return "format must be ndjson or csv."
+        if (batch_size < 1 or batch_size > MAX_BATCH_SIZE):
+            response.status = 400
+            return f"batch must be between 1 and {MAX_BATCH_SIZE}."
+
+        lines = readLines(readChunks(request.environ))
+        records = csvRecords(lines) if format == 'csv' else ndjsonRecords(lines)
+        response.content_type = 'application/x-ndjson'
+        return (serializer.dumps(report) + '\n' for report in importQuestions(records, batch_size))
+
+    @app.get('/export')
+    def getExport():
+        '''Streams every question with its options, rubrics and setup, as a
+           JSON array or with ?format=ndjson one document per line'''
+        format = request.query.get('format', 'json')
+        if (format not in ('json', 'ndjson')):
+            response.status = 400
+            return "format must be json or ndjson."
+
+        with db.connect() as conn:
+            revs = [str(row['value']) for row in conn.execute("SELECT value FROM Revision ORDER BY name")]
+        etag.check('.'.join(revs))
+
+        if (format == 'ndjson'):
+            response.content_type = 'application/x-ndjson'
+            return _buffered(exportNDJSON(exportDocuments()))
+        response.content_type = 'application/json'
+        return _buffered(exportJSON(exportDocuments()))
@@ -0,0 +1,107 @@
+'''Measures question reads per second while other processes keep writing,
+   like the workers of a multi-process deployment, once with SQLite's
+   default rollback journal and once with the db.PRAGMAS profile.
+
+   Run from the repository root:  python benchmarks/concurrency.py [readers] [writers] [seconds]'''
+
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+from question import Question
+
+QUESTIONS = 5000
+PROFILES = {
+    'rollback journal': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+    'db.PRAGMAS': db.PRAGMAS,
+}
+
+
+def populate(questions):
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        for i in range(questions):
+            Question.insert(cursor, {'type': 'mc', 'question_text': f'question {i}', 'points': 1, 'setup': None,
+                                     'options': [{'is_true': j == 0, 'option_text': f'option {j}'} for j in range(4)]})
+
+
+def reader(path, pragmas, seconds, results):
+    db.configure(path, pragmas=pragmas)
+    reads = errors = 0
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            Question.findDocument(random.randint(1, QUESTIONS))
+            reads += 1
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put(('read', reads, errors, latencies))
+
+
+def writer(path, pragmas, seconds, results):
+    db.configure(path, pragmas=pragmas)
+    writes = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            with db.transaction() as conn:
+                Question.insert(conn.cursor(), {'type': 'sa', 'question_text': 'written during the run', 'points': 1,
+                                                'setup': None, 'answer': 'a', 'rubrics': [{'rubric_text': 'r', 'points': 1}]})
+            writes += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put(('write', writes, errors, []))
+
+
+def measure(path, pragmas, readers, writers, seconds):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reader, args=(path, pragmas, seconds, results)) for _ in range(readers)]
+    processes += [multiprocessing.Process(target=writer, args=(path, pragmas, seconds, results)) for _ in range(writers)]
+    for process in processes:
+        process.start()
+    totals = {'read': [0, 0, []], 'write': [0, 0, []]}
+    for _ in processes:
+        kind, count, errors, latencies = results.get()
+        totals[kind][0] += count
+        totals[kind][1] += errors
+        totals[kind][2] += latencies
+    for process in processes:
+        process.join()
+    return totals
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    random.seed(521)
+
+    print(f'{readers} reader and {writers} writer processes for {seconds:g}s, {QUESTIONS} questions')
+    print(f'{"profile":18} {"reads/s":>10} {"p99 read ms":>12} {"writes/s":>10} {"errors":>8}')
+    for name, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            db.configure(path, pragmas=pragmas)
+            db.resetDB()
+            populate(QUESTIONS)
+            db.pool.close()
+
+            totals = measure(path, pragmas, readers, writers, seconds)
+        reads, read_errors, latencies = totals['read']
+        writes, write_errors, _ = totals['write']
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('nan')
+        print(f'{name:18} {reads / seconds:10.0f} {p99:12.2f} {writes / seconds:10.0f} {read_errors + write_errors:8}')
+
+
+if __name__ == '__main__':
+    main()
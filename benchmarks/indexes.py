@@ -0,0 +1,77 @@
+'''Times the lookups that the schema migration indexes, before and after
+   running db.migrate(), on a scratch database with 100k rows per table.
+
+   Run from the repository root:  python benchmarks/indexes.py [rows]'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+LOOKUPS = 200
+
+
+def populate(rows):
+    types = ['mc', 'sa', 'sql']
+    with db.connect() as conn:
+        conn.executemany("INSERT INTO Setup (id, setup_text) VALUES (?, ?)",
+                         ((i, f'setup {i}') for i in range(1, rows // 100 + 1)))
+        conn.executemany("INSERT INTO Question (id, type, question_text, points, setup, answer) VALUES (?, ?, ?, ?, ?, ?)",
+                         ((i, types[i % 3], f'question text {i}', 1 + i % 5, 1 + i % (rows // 100), 'answer')
+                          for i in range(1, rows + 1)))
+        conn.executemany("INSERT INTO MCOption (is_true, option_text, qid) VALUES (?, ?, ?)",
+                         ((i % 4 == 0, f'option {i}', 1 + random.randrange(rows)) for i in range(rows)))
+        conn.executemany("INSERT INTO Rubric (rubric_text, points, qid) VALUES (?, ?, ?)",
+                         ((f'rubric {i}', 1.0, 1 + random.randrange(rows)) for i in range(rows)))
+
+
+def timed(conn, sql, qids):
+    start = time.perf_counter()
+    for qid in qids:
+        conn.execute(sql, (qid,)).fetchall()
+    return (time.perf_counter() - start) / len(qids) * 1000
+
+
+def measure(rows):
+    qids = [1 + random.randrange(rows) for _ in range(LOOKUPS)]
+    with db.connect() as conn:
+        results = {
+            'MC options of a question': timed(conn, "SELECT * FROM MCOption WHERE qid = ? AND is_true = 1", qids),
+            'rubrics of a question': timed(conn, "SELECT * FROM Rubric WHERE qid = ?", qids),
+            'questions sharing a setup': timed(conn, "SELECT id FROM Question WHERE setup = ?", qids),
+            'questions of a type': timed(conn, "SELECT COUNT(*) FROM Question WHERE type = ?", ['mc', 'sa', 'sql'] * 10),
+        }
+        start = time.perf_counter()
+        for qid in qids:
+            conn.execute("DELETE FROM MCOption WHERE qid = ?", (qid,))
+            conn.execute("DELETE FROM Rubric WHERE qid = ?", (qid,))
+        results['cascade delete of a question'] = (time.perf_counter() - start) / len(qids) * 1000
+        conn.rollback()
+    return results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(521)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, 'bench.db'))
+        db.resetDB(upgrade=False)
+        populate(rows)
+
+        scan = measure(rows)
+        db.migrate()
+        indexed = measure(rows)
+        db.pool.close()
+
+    print(f'{rows} rows per table, mean ms per lookup')
+    print(f'{"query":32} {"scan":>10} {"indexed":>10} {"speedup":>9}')
+    for name in scan:
+        print(f'{name:32} {scan[name]:10.3f} {indexed[name]:10.3f} {scan[name] / indexed[name]:8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
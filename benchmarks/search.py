@@ -0,0 +1,71 @@
+'''Times GET /search queries on a scratch database of generated questions,
+   one million by default, indexed by the QuestionSearch triggers as they
+   are inserted.
+
+   Run from the repository root:  python benchmarks/search.py [questions]'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+import search
+
+QUERIES = 200
+# A vocabulary with a long tail, so queries range from common to rare words
+WORDS = [f'term{i}' for i in range(20000)] + 'select join where group having index table row column key'.split()
+
+
+def words(count):
+    return ' '.join(random.choice(WORDS[-10:]) if random.random() < 0.3 else random.choice(WORDS) for _ in range(count))
+
+
+def populate(questions):
+    types = ['mc', 'sa', 'sql']
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO Question (id, type, question_text, points, setup, answer) VALUES (?, ?, ?, ?, NULL, ?)",
+                         ((i, types[i % 3], words(15), 1, words(8)) for i in range(1, questions + 1)))
+        conn.executemany("INSERT INTO MCOption (is_true, option_text, qid) VALUES (?, ?, ?)",
+                         ((j == 0, words(4), i) for i in range(1, questions + 1, 3) for j in range(3)))
+
+
+def timed(queries):
+    times = []
+    for text in queries:
+        start = time.perf_counter()
+        search.search(text)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return sum(times) / len(times), times[len(times) // 2], times[int(len(times) * 0.99)]
+
+
+def main():
+    questions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(521)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, 'bench.db'))
+        db.resetDB()
+        start = time.perf_counter()
+        populate(questions)
+        print(f'{questions} questions inserted and indexed in {time.perf_counter() - start:.1f}s')
+        db.optimize()
+
+        kinds = {
+            'one rare word': [random.choice(WORDS[:-10]) for _ in range(QUERIES)],
+            'two rare words': [f'{random.choice(WORDS[:-10])} {random.choice(WORDS[:-10])}' for _ in range(QUERIES)],
+            'rare word prefix': [random.choice(WORDS[:-10])[:-1] + '*' for _ in range(QUERIES)],
+            'common + rare word': [f'{random.choice(WORDS[-10:])} {random.choice(WORDS[:-10])}' for _ in range(QUERIES)],
+            'one common word': [random.choice(WORDS[-10:]) for _ in range(QUERIES // 10)],
+        }
+        print(f'{"query":20} {"mean ms":>8} {"p50 ms":>8} {"p99 ms":>8}')
+        for name, queries in kinds.items():
+            mean, p50, p99 = timed(queries)
+            print(f'{name:20} {mean:8.2f} {p50:8.2f} {p99:8.2f}')
+        db.pool.close()
+
+
+if __name__ == '__main__':
+    main()
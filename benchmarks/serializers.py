@@ -0,0 +1,85 @@
+'''Times every JSON serializer in serializer.BACKENDS on the responses the
+   routes actually send: single question documents, a page of documents
+   from GET /question?ids= and the whole question index, built from a
+   scratch database of generated questions.
+
+   Run from the repository root:  python benchmarks/serializers.py [questions]'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+import serializer
+from question import Question
+
+ROUNDS = 2000
+WORDS = 'select join where group having index table row column key value null'.split()
+
+
+def sentence(words):
+    return ' '.join(random.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def populate(questions):
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        setup = Question.insert(cursor, {'type': 'sql', 'question_text': sentence(20), 'points': 5, 'answer': 'SELECT 1',
+                                         'setup': {'setup_text': 'CREATE TABLE t (a INTEGER, b TEXT);'}})
+        setup = Question.find(setup).setup
+        for i in range(questions):
+            q_type = ('mc', 'sa', 'sql')[i % 3]
+            question = {'type': q_type, 'question_text': sentence(random.randint(8, 40)), 'points': random.randint(1, 10),
+                        'setup': setup if q_type == 'sql' else None, 'answer': sentence(15)}
+            if q_type == 'mc':
+                question['options'] = [{'is_true': j == 0, 'option_text': sentence(6)} for j in range(random.randint(3, 6))]
+            if q_type == 'sa':
+                question['rubrics'] = [{'rubric_text': sentence(10), 'points': 1.5} for _ in range(random.randint(2, 5))]
+            Question.insert(cursor, question)
+
+
+def payloads(questions):
+    ids = list(range(1, questions + 1))
+    documents = Question.findDocuments(ids)
+    mc_digest, sa_digest, sql_digest = Question.getAllIDs()
+    return {
+        'one document': [documents[id] for id in ids[1:101]],
+        '100 documents (?ids=)': [{'questions': [documents[id] for id in ids[1:101]], 'missing': []}],
+        f'index of {questions}': [{'mc': mc_digest, 'sa': sa_digest, 'sql': sql_digest}],
+    }
+
+
+def timed(dumpb, objects, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds // len(objects) or 1):
+        for obj in objects:
+            dumpb(obj)
+    calls = (rounds // len(objects) or 1) * len(objects)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    questions = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    random.seed(521)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, 'bench.db'))
+        db.resetDB()
+        populate(questions)
+        samples = payloads(questions)
+        db.pool.close()
+
+    print(f'{questions} questions, mean microseconds per response and bytes sent')
+    print(f'{"payload":24} {"serializer":10} {"us":>10} {"bytes":>10} {"vs stdlib":>10}')
+    for payload, objects in samples.items():
+        rounds = ROUNDS if len(objects) > 1 else ROUNDS // 20
+        results = {name: (timed(dumpb, objects, rounds), sum(len(dumpb(obj)) for obj in objects) // len(objects))
+                   for name, (dumps, dumpb) in sorted(serializer.BACKENDS.items())}
+        for name, (elapsed, size) in results.items():
+            print(f'{payload:24} {name:10} {elapsed:10.1f} {size:10} {results["stdlib"][0] / elapsed:9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
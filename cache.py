@@ -0,0 +1,83 @@
+import collections
+import threading
+import time
+
+
+class LRUCache:
+    '''Thread safe cache that holds at most maxsize entries, evicting the least
+       recently used one when full. Entries also expire ttl seconds after they
+       were stored.'''
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the value stored for key, or None if it isn't cached'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# (rev, document) pairs of question documents as built by Question.jsonable(),
+# keyed by question id. A document is only served while the question is still
+# at that rev. Anything that writes a question or one of its options or
+# rubrics also invalidates the entry to free it early.
+documents = LRUCache()
+
+# Compressed response bodies kept by compression.Compressor, keyed by (path,
+# query string, ETag, encoding). The ETag changes with the body, so entries
+# never have to be invalidated.
+compressed = LRUCache(maxsize=256)
+
+# (rev, grading.AnswerKey) pairs of multiple choice questions, keyed by
+# question id and only used while the question is still at that rev
+answerKeys = LRUCache(maxsize=4096)
+# (rev, grading.RubricMatcher) pairs of short answer questions, the same way
+rubricMatchers = LRUCache(maxsize=4096)
+
+
+def configure(maxsize=1024, ttl=300):
+    '''Replaces the document cache with an empty one of the given size and ttl'''
+    global documents
+    documents = LRUCache(maxsize, ttl)
+
+
+def setupBottleRoutes(app):
+    @app.get('/cache/stats')
+    def getCacheStats():
+        return {'documents': documents.stats(), 'compressed': compressed.stats(), 'answerKeys': answerKeys.stats(),
+                'rubricMatchers': rubricMatchers.stats()}
@@ -0,0 +1,144 @@
+import zlib
+import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# WSGI middleware compressing responses for clients that send
+# Accept-Encoding. Whole bodies of at least `minimum` bytes are compressed in
+# one go, and the result is kept in cache.compressed when the response has an
+# ETag, since the same tag on the same URL always means the same body.
+# Streamed bodies, which have no Content-Length, are compressed chunk by
+# chunk and flushed after each one so the client still gets every chunk as
+# soon as it is written.
+
+MINIMUM_SIZE = 1024
+LEVEL = 6
+BROTLI_QUALITY = 5
+# Largest compressed body kept in cache.compressed
+CACHE_MAX = 1024 * 1024
+COMPRESSIBLE = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml')
+
+
+class _ZlibStream:
+    '''gzip or deflate compressor with the same interface as brotli's'''
+
+    def __init__(self, wbits, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def process(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# Supported encodings in order of preference, each with a function returning
+# a new compressor for the given zlib level
+ENCODINGS = {}
+if brotli is not None:
+    ENCODINGS['br'] = lambda level: brotli.Compressor(quality=BROTLI_QUALITY)
+ENCODINGS['gzip'] = lambda level: _ZlibStream(16 + zlib.MAX_WBITS, level)
+ENCODINGS['deflate'] = lambda level: _ZlibStream(zlib.MAX_WBITS, level)
+
+
+def negotiate(header):
+    '''Returns the preferred supported encoding that an Accept-Encoding
+       header allows, or None if the body has to be sent as it is'''
+    weights = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding.strip():
+            weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in ENCODINGS:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class Compressor:
+    '''Wraps a WSGI app so its responses are compressed when the client
+       accepts it and the body is worth it'''
+
+    def __init__(self, app, minimum=MINIMUM_SIZE, level=LEVEL):
+        self.app = app
+        self.minimum = minimum
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            # Bottle never uses the write() callable, so the real
+            # start_response can wait until the body has been looked at
+            captured['status'], captured['headers'], captured['exc_info'] = status, headers, exc_info
+
+        body = self.app(environ, capture)
+        status, headers = captured['status'], captured['headers']
+        fields = {name.lower(): value for name, value in headers}
+
+        ctype = fields.get('content-type', '').split(';')[0].strip()
+        if not ctype.startswith(COMPRESSIBLE) or 'content-encoding' in fields:
+            start_response(status, headers, captured['exc_info'])
+            return body
+
+        vary = fields.get('vary')
+        headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+        headers.append(('Vary', f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'))
+
+        length = fields.get('content-length')
+        if (encoding is None or not status.startswith('200') or environ['REQUEST_METHOD'] == 'HEAD'
+                or 'no-transform' in fields.get('cache-control', '')
+                or (length is not None and int(length) < self.minimum)):
+            start_response(status, headers, captured['exc_info'])
+            return body
+
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        headers.append(('Content-Encoding', encoding))
+        if length is None:
+            start_response(status, headers, captured['exc_info'])
+            return self.stream(body, encoding)
+
+        key = (environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', ''), fields.get('etag'), encoding)
+        compressed = cache.compressed.get(key) if fields.get('etag') else None
+        try:
+            if compressed is None:
+                compressor = ENCODINGS[encoding](self.level)
+                compressed = b''.join(compressor.process(chunk) for chunk in body) + compressor.finish()
+                if fields.get('etag') and len(compressed) <= CACHE_MAX:
+                    cache.compressed.put(key, compressed)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        headers.append(('Content-Length', str(len(compressed))))
+        start_response(status, headers, captured['exc_info'])
+        return [compressed]
+
+    def stream(self, body, encoding):
+        '''Yields body compressed, flushing the compressor after every chunk'''
+        compressor = ENCODINGS[encoding](self.level)
+        try:
+            for chunk in body:
+                if chunk:
+                    yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
@@ -1,12 +1,503 @@
+import contextlib
+import os
+import queue
 import sqlite3
+import sys
+import threading
+import urllib.parse
+
+DB_PATH = 'a4.db'
+POOL_SIZE = 8
+# Most values bound into one statement, kept under SQLite's oldest default limit
+MAX_PARAMS = 500
+
+# PRAGMAs every new connection runs, in order. WAL lets readers carry on while
+# a write is in progress, and with synchronous=NORMAL a commit only waits for
+# the WAL to be written, not synced. busy_timeout is how long a write waits
+# for the lock before failing with "database is locked".
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    # Checkpoint the WAL back into the database once it reaches this many
+    # pages. The pool also truncates it to nothing when it is closed.
+    'wal_autocheckpoint': 1000,
+}
+# Seconds between refreshes of the snapshot that reads can be routed to
+SNAPSHOT_INTERVAL = 30
+
+
+class ConnectionPool:
+    '''Keeps up to `size` idle connections to the database warm so requests
+       don't pay for opening the file and setting up the row factory on every
+       query. A thread keeps the connection it checked out until its outermost
+       `with connect()` block exits, so nested blocks share one transaction.
+       A forked worker process starts over with connections of its own.
+       A readonly pool opens connections that can't write to the file.'''
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, pragmas=PRAGMAS, readonly=False):
+        self.path = path
+        self.size = size
+        self.pragmas = pragmas
+        self.readonly = readonly
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _forked(self):
+        '''Forgets the connections inherited from the parent process, which
+           must never be used or closed by a child, when running in a new one'''
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue(maxsize=self.size)
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+    def open(self):
+        '''Opens a brand new connection configured the way the models expect'''
+        if self.readonly:
+            uri = f"file:{urllib.parse.quote(os.path.abspath(self.path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            # Switching the journal mode is a write
+            if not (self.readonly and name == 'journal_mode'):
+                conn.execute(f"PRAGMA {name} = {value}")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def healthy(self, conn):
+        '''Returns True if an idle connection can still run a query'''
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        '''Hands out a healthy idle connection, opening a new one if none is left'''
+        self._forked()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self.open()
+            if self.healthy(conn):
+                return conn
+            conn.close()
+
+    def release(self, conn):
+        '''Returns a connection to the pool, closing it if the pool is full'''
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def active(self):
+        '''Returns True if this thread has a connection checked out'''
+        self._forked()
+        return getattr(self._local, 'depth', 0) > 0
+
+    def checkout(self):
+        '''Context manager yielding this thread's connection. The outermost
+           block commits on success and rolls back on error.'''
+        return _Checkout(self)
+
+    def close(self):
+        '''Closes every idle connection, used when the app shuts down. The
+           last one checkpoints the whole WAL into the database first.'''
+        self._forked()
+        conns = []
+        while True:
+            try:
+                conns.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for i, conn in enumerate(conns):
+            if i == len(conns) - 1 and not self.readonly:
+                checkpoint(conn)
+            conn.close()
+
+
+class _Checkout:
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        self.pool._forked()
+        local = self.pool._local
+        if getattr(local, 'depth', 0) == 0:
+            local.conn = self.pool.acquire()
+            local.depth = 0
+        local.depth += 1
+        return local.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        local = self.pool._local
+        local.depth -= 1
+        if local.depth > 0:
+            return False
+
+        conn, local.conn = local.conn, None
+        try:
+            if exc_type is None:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            self.pool.release(conn)
+        return False
+
+
+class Snapshot:
+    '''A copy of the database at path that a background thread brings up to
+       date every interval seconds with SQLite's online backup. The copy is
+       written in one transaction while its readers keep reading the previous
+       state, and the backup doesn't hold up writers of the live database.'''
+
+    def __init__(self, path, interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='db-snapshot', daemon=True)
+
+    def refresh(self):
+        '''Copies the live database over the snapshot'''
+        source = pool.acquire()
+        target = sqlite3.connect(self.path, timeout=PRAGMAS['busy_timeout'] / 1000)
+        try:
+            source.backup(target)
+            target.execute("PRAGMA journal_mode = WAL")
+        finally:
+            target.close()
+            pool.release(source)
+
+    def start(self):
+        self.refresh()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except sqlite3.Error as err:
+                print(f"Snapshot refresh failed: {err}", file=sys.stderr)
+
+    def stop(self):
+        self._stop.set()
+
+
+class ConnectionPlugin:
+    '''Bottle plugin that routes the queries of GET routes to read-only
+       connections and closes the pooled connections when the app is closed'''
+    name = 'db'
+    api = 2
+
+    def apply(self, callback, route):
+        if route.method != 'GET':
+            return callback
+
+        def readOnly(*args, **kwargs):
+            with reading():
+                return callback(*args, **kwargs)
+        return readOnly
+
+    def close(self):
+        if snapshot is not None:
+            snapshot.stop()
+        pool.close()
+        readers.close()
+
+
+pool = ConnectionPool()
+# Read-only connections to the database, or to the snapshot if there is one
+readers = ConnectionPool(readonly=True)
+snapshot = None
+_routing = threading.local()
+
+
+def configure(path=DB_PATH, size=POOL_SIZE, pragmas=PRAGMAS):
+    '''Replaces the shared pools, closing the connections of the old ones'''
+    global pool, readers, snapshot
+    if snapshot is not None:
+        snapshot.stop()
+        snapshot = None
+    pool.close()
+    readers.close()
+    pool = ConnectionPool(path, size, pragmas)
+    readers = ConnectionPool(path, size, pragmas, readonly=True)
+
+
+def configureReads(snapshot_path=None, interval=SNAPSHOT_INTERVAL):
+    '''Points the read-only connections at the live database, or with
+       snapshot_path at a copy of it refreshed every interval seconds. Reads
+       from a snapshot can be up to interval seconds out of date but never
+       wait on the writers of the live database.'''
+    global readers, snapshot
+    if snapshot is not None:
+        snapshot.stop()
+        snapshot = None
+    if snapshot_path is not None:
+        snapshot = Snapshot(snapshot_path, interval)
+        snapshot.start()
+    readers.close()
+    readers = ConnectionPool(snapshot_path or pool.path, pool.size, pool.pragmas, readonly=True)
+
+
+def checkpoint(conn=None, mode='TRUNCATE'):
+    '''Copies every committed page of the WAL into the database, and with
+       TRUNCATE empties the WAL file. Returns SQLite's (busy, WAL pages,
+       pages checkpointed), busy being 1 if a reader kept it from finishing.'''
+    if conn is None:
+        with connect() as conn:
+            return checkpoint(conn, mode)
+    try:
+        return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+    except sqlite3.Error:
+        return None
 
 
 def connect():
-    conn = sqlite3.connect('a4.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    '''Context manager yielding this thread's connection. Inside reading(),
+       unless a write connection is already checked out, it is a read-only one.'''
+    if getattr(_routing, 'reading', False) and not pool.active():
+        return readers.checkout()
+    return pool.checkout()
+
+
+@contextlib.contextmanager
+def reading():
+    '''Sends the connect() blocks inside it to the read-only connections'''
+    outer = getattr(_routing, 'reading', False)
+    _routing.reading = True
+    try:
+        yield
+    finally:
+        _routing.reading = outer
+
+
+@contextlib.contextmanager
+def transaction():
+    '''Like connect(), but always on a writable connection and taking the
+       write lock up front with BEGIN IMMEDIATE so a batch of writes can't
+       fail halfway through on a busy database'''
+    with pool.checkout() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+
+
+def _bumpRevision(table, ids):
+    '''Trigger statements that draw the next value of table's Revision counter
+       and store it as the rev of the rows whose id is in ids'''
+    return f"""UPDATE Revision SET value = value + 1 WHERE name = '{table}';
+               UPDATE {table} SET rev = (SELECT value FROM Revision WHERE name = '{table}') WHERE id IN ({ids});"""
+
+
+def _revisionTriggers(table, owned_by_question=False):
+    '''Triggers that give a row of table a new rev whenever it is written and
+       count every insert, update and delete in table's Revision counter. Rows
+       owned by a question also give that question a new rev.'''
+    parent = lambda ids: _bumpRevision('Question', ids) if owned_by_question else ''
+    return [
+        f"""CREATE TRIGGER {table}_insert_rev AFTER INSERT ON {table} BEGIN
+              {_bumpRevision(table, 'NEW.id')}
+              {parent('NEW.qid')}
+            END""",
+        f"""CREATE TRIGGER {table}_update_rev AFTER UPDATE ON {table} WHEN NEW.rev = OLD.rev BEGIN
+              {_bumpRevision(table, 'NEW.id')}
+              {parent('OLD.qid, NEW.qid')}
+            END""",
+        f"""CREATE TRIGGER {table}_delete_rev AFTER DELETE ON {table} BEGIN
+              UPDATE Revision SET value = value + 1 WHERE name = '{table}';
+              {parent('OLD.qid')}
+            END""",
+    ]
+
+
+def _searchRows(where=''):
+    '''Statement indexing the questions that match where, along with their
+       options, rubrics and setup'''
+    return f"""INSERT INTO QuestionSearch (rowid, question_text, answer, options, rubrics, setup)
+                 SELECT Question.id, Question.question_text,
+                        CASE WHEN Question.type = 'mc' THEN NULL ELSE Question.answer END,
+                        (SELECT group_concat(option_text, ' ') FROM MCOption WHERE qid = Question.id),
+                        (SELECT group_concat(rubric_text, ' ') FROM Rubric WHERE qid = Question.id),
+                        Setup.setup_text
+                 FROM Question LEFT JOIN Setup ON Setup.id = Question.setup
+                 {where}"""
+
 
-def resetDB():
+def _searchRefresh(ids):
+    '''Trigger statements that index the questions whose id is in ids again'''
+    return f"""DELETE FROM QuestionSearch WHERE rowid IN ({ids});
+               {_searchRows(f'WHERE Question.id IN ({ids})')};"""
+
+
+def _searchTriggers():
+    '''Triggers that keep QuestionSearch in step with every write to the
+       tables it indexes'''
+    triggers = [
+        f"""CREATE TRIGGER Question_insert_search AFTER INSERT ON Question BEGIN
+              {_searchRefresh('NEW.id')}
+            END""",
+        f"""CREATE TRIGGER Question_update_search AFTER UPDATE OF type, question_text, setup, answer ON Question BEGIN
+              {_searchRefresh('OLD.id, NEW.id')}
+            END""",
+        """CREATE TRIGGER Question_delete_search AFTER DELETE ON Question BEGIN
+              DELETE FROM QuestionSearch WHERE rowid = OLD.id;
+            END""",
+        f"""CREATE TRIGGER Setup_update_search AFTER UPDATE OF setup_text ON Setup BEGIN
+              {_searchRefresh('SELECT id FROM Question WHERE setup = NEW.id')}
+            END""",
+        f"""CREATE TRIGGER Setup_delete_search AFTER DELETE ON Setup BEGIN
+              {_searchRefresh('SELECT id FROM Question WHERE setup = OLD.id')}
+            END""",
+    ]
+    for table, column in (('MCOption', 'option_text'), ('Rubric', 'rubric_text')):
+        triggers += [
+            f"""CREATE TRIGGER {table}_insert_search AFTER INSERT ON {table} BEGIN
+                  {_searchRefresh('NEW.qid')}
+                END""",
+            f"""CREATE TRIGGER {table}_update_search AFTER UPDATE OF {column}, qid ON {table} BEGIN
+                  {_searchRefresh('OLD.qid, NEW.qid')}
+                END""",
+            f"""CREATE TRIGGER {table}_delete_search AFTER DELETE ON {table} BEGIN
+                  {_searchRefresh('OLD.qid')}
+                END""",
+        ]
+    return triggers
+
+
+# Schema migrations as (version, statements) pairs. Each one is applied once,
+# in order, and recorded in schema_version. Append new versions at the end and
+# never change one that has already shipped.
+MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS MCOption_qid_is_true ON MCOption(qid, is_true)",
+        "CREATE INDEX IF NOT EXISTS Rubric_qid ON Rubric(qid)",
+        "CREATE INDEX IF NOT EXISTS Question_type_id ON Question(type, id)",
+        "CREATE INDEX IF NOT EXISTS Question_setup ON Question(setup)",
+    ]),
+    (2, [
+        """CREATE TABLE QuestionDigest (
+             id INTEGER PRIMARY KEY,
+             type TEXT,
+             blurb TEXT
+           )""",
+        "INSERT INTO QuestionDigest (id, type, blurb) SELECT id, type, SUBSTRING(question_text, 1, 40) FROM Question",
+    ]),
+    (3, [
+        "CREATE INDEX IF NOT EXISTS QuestionDigest_type_id ON QuestionDigest(type, id)",
+    ]),
+    # Revisions behind the ETags. Every row gets a rev that changes whenever
+    # it does, drawn from a per table counter in Revision so a rev is never
+    # reused, not even for a recycled id. The counter itself versions the index.
+    (4, [
+        "ALTER TABLE Question ADD COLUMN rev INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE MCOption ADD COLUMN rev INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE Rubric ADD COLUMN rev INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE Setup ADD COLUMN rev INTEGER NOT NULL DEFAULT 0",
+        """CREATE TABLE Revision (
+             name TEXT PRIMARY KEY,
+             value INTEGER NOT NULL
+           )""",
+        "INSERT INTO Revision (name, value) VALUES ('Question', 0), ('MCOption', 0), ('Rubric', 0), ('Setup', 0)",
+    ] + _revisionTriggers('Question')
+      + _revisionTriggers('MCOption', owned_by_question=True)
+      + _revisionTriggers('Rubric', owned_by_question=True)
+      + _revisionTriggers('Setup')),
+    # Pre-rendered question documents, only filled while prerender is enabled
+    (5, [
+        """CREATE TABLE QuestionDocument (
+             id INTEGER PRIMARY KEY,
+             rev INTEGER NOT NULL,
+             body BLOB NOT NULL
+           )""",
+    ]),
+    # Full text index of every question, with the text of its options,
+    # rubrics and setup, for GET /search. The rowid is the question's id.
+    (6, [
+        """CREATE VIRTUAL TABLE QuestionSearch USING fts5(
+             question_text, answer, options, rubrics, setup,
+             tokenize = 'porter unicode61'
+           )""",
+        # Weights of the columns above when ranking matches
+        "INSERT INTO QuestionSearch (QuestionSearch, rank) VALUES ('rank', 'bm25(10.0, 4.0, 4.0, 4.0, 1.0)')",
+        _searchRows(),
+    ] + _searchTriggers()),
+    # Counts the writes to what the exam index holds of each question, which
+    # unlike the Question counter doesn't move with its options and rubrics
+    (7, [
+        "INSERT INTO Revision (name, value) VALUES ('QuestionIndex', 0)",
+        """CREATE TRIGGER Question_insert_index AFTER INSERT ON Question BEGIN
+             UPDATE Revision SET value = value + 1 WHERE name = 'QuestionIndex';
+           END""",
+        """CREATE TRIGGER Question_update_index AFTER UPDATE OF id, type, points, setup ON Question BEGIN
+             UPDATE Revision SET value = value + 1 WHERE name = 'QuestionIndex';
+           END""",
+        """CREATE TRIGGER Question_delete_index AFTER DELETE ON Question BEGIN
+             UPDATE Revision SET value = value + 1 WHERE name = 'QuestionIndex';
+           END""",
+    ]),
+]
+
+
+def revision(table, id=None):
+    '''Returns the rev of the row of table with the specified id, or of the
+       table as a whole if no id is given. None if there is no such row.'''
+    with connect() as conn:
+        if id is None:
+            row = conn.execute("SELECT value AS rev FROM Revision WHERE name = ?", (table,)).fetchone()
+        else:
+            row = conn.execute(f"SELECT rev FROM {table} WHERE id = ?", (id,)).fetchone()
+    return None if row is None else row['rev']
+
+
+def optimize():
+    '''Merges the full text index into a single b-tree. Searches after a
+       large import take about half as long once it has run.'''
+    with transaction() as conn:
+        conn.execute("INSERT INTO QuestionSearch (QuestionSearch) VALUES ('optimize')")
+
+
+def schemaVersion():
+    '''Returns the latest migration applied to the database, 0 if none'''
+    with connect() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY)")
+        row = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    return row['version'] or 0
+
+
+def migrate():
+    '''Applies every pending migration, each in its own transaction, and
+       returns the resulting schema version. Existing rows are kept, so this
+       is safe to run against a database that is already in use, also by
+       several processes starting at once: each step takes the write lock
+       first and checks again that nobody applied it meanwhile.'''
+    version = schemaVersion()
+    for target, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        with transaction() as conn:
+            version = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()['version'] or 0
+            if target <= version:
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (target,))
+        version = target
+    return version
+
+def resetDB(upgrade=True):
 
     with connect() as db:
         db.execute("DROP TABLE IF EXISTS MCOption")
@@ -56,8 +547,26 @@ def resetDB():
         
         """)
 
+    with connect() as db:
+        db.execute("DROP TABLE IF EXISTS QuestionDigest")
+        db.execute("DROP TABLE IF EXISTS QuestionDocument")
+        db.execute("DROP TABLE IF EXISTS QuestionSearch")
+        db.execute("DROP TABLE IF EXISTS Revision")
+        db.execute("DROP TABLE IF EXISTS schema_version")
+
+    if upgrade:
+        migrate()
+
 if __name__ == "__main__":
-    print("Resetting database")
-    resetDB()
+    if sys.argv[1:] == ['migrate']:
+        print(f"Database at schema version {migrate()}")
+    elif sys.argv[1:] == ['optimize']:
+        optimize()
+        print("Search index optimized")
+    elif sys.argv[1:] == ['checkpoint']:
+        print(f"WAL checkpoint (busy, pages, checkpointed): {checkpoint()}")
+    else:
+        print("Resetting database")
+        resetDB()
 
         
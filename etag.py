@@ -0,0 +1,29 @@
+from bottle import HTTPResponse, request, response
+
+# Conditional GET support. Resources are tagged with the rev that db.revision()
+# reports for them, which changes on every write, so a client that sends back
+# the tag it was given can be answered with 304 before anything is built.
+
+
+def opaque(tag):
+    '''Returns tag without the W/ prefix of a weak ETag'''
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def matches(header, etag):
+    '''Returns True if an If-None-Match header value lists etag, using the weak
+       comparison RFC 7232 requires for If-None-Match'''
+    if not header:
+        return False
+    tags = [opaque(tag) for tag in header.split(',')]
+    return '*' in tags or opaque(etag) in tags
+
+
+def check(rev):
+    '''Tags the response with rev and ends the request with 304 Not Modified
+       if the client already has that version'''
+    etag = f'W/"{rev}"'
+    if matches(request.get_header('If-None-Match'), etag):
+        raise HTTPResponse(status=304, headers={'ETag': etag})
+    response.set_header('ETag', etag)
@@ -0,0 +1,197 @@
+import json
+import random
+import threading
+import db
+from bottle import response, request
+from question import Question
+
+# Exam assembly. Choosing questions only needs (id, type, points, setup) of
+# each one, which is kept in memory and reloaded whenever the QuestionIndex
+# revision counter shows that one of those has changed, so an exam is put
+# together without touching the database until its documents are loaded.
+# Writing an option or rubric leaves the index as it is.
+
+TYPES = ('mc', 'sa', 'sql')
+# Passes of the point balancing search before settling for the closest total
+MAX_SWAPS = 1000
+
+
+class QuestionIndex:
+    '''The ids of every question at revision rev grouped by type, by type
+       and points, and by setup, with the type and points of each. Never
+       changed once loaded.'''
+
+    def __init__(self, rev):
+        self.rev = rev
+        self.byType = {q_type: [] for q_type in TYPES}
+        self.byPoints = {q_type: {} for q_type in TYPES}
+        self.bySetup = {}
+        self.types = {}
+        self.points = {}
+        with db.connect() as conn:
+            for row in conn.execute("SELECT id, type, points, setup FROM Question ORDER BY id"):
+                if row['type'] not in self.byType:
+                    continue
+                self.byType[row['type']].append(row['id'])
+                self.byPoints[row['type']].setdefault(row['points'], []).append(row['id'])
+                self.types[row['id']] = row['type']
+                self.points[row['id']] = row['points']
+                if row['setup'] is not None:
+                    self.bySetup.setdefault(row['setup'], []).append(row['id'])
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def currentIndex():
+    '''Returns the index of the questions as they are now, loading it again
+       only if a question was added, removed, or given another type, points
+       or setup since it was last loaded'''
+    global _index
+    rev = db.revision('QuestionIndex')
+    if _index is None or _index.rev != rev:
+        with _lock:
+            if _index is None or _index.rev != rev:
+                _index = QuestionIndex(rev)
+    return _index
+
+
+def parseConstraints(data):
+    '''Checks the body of POST /exam/assemble and returns (counts, target,
+       setups, seed). Exception raised if something is not right.'''
+    if not isinstance(data, dict):
+        raise Exception(f'Expected a JSON object of constraints.')
+    counts = data.get('counts') or {}
+    if not isinstance(counts, dict) or any(q_type not in TYPES for q_type in counts):
+        raise Exception(f'counts must map question types sql, sa, or mc to a number of questions.')
+    if any(not isinstance(count, int) or count < 0 for count in counts.values()):
+        raise Exception(f'Question counts must be whole numbers of at least 0.')
+    if not 0 < sum(counts.values()) <= db.MAX_PARAMS:
+        raise Exception(f'An exam must have between 1 and {db.MAX_PARAMS} questions.')
+
+    target = data.get('points')
+    if target is not None and (not isinstance(target, (int, float)) or target <= 0):
+        raise Exception(f'Point target must be greater than 0.')
+    setups = data.get('setups') or []
+    if not isinstance(setups, list) or any(not isinstance(setup, int) for setup in setups):
+        raise Exception(f'setups must be a list of setup ids.')
+    seed = data.get('seed')
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if not isinstance(seed, int):
+        raise Exception(f'seed must be an integer.')
+    return {q_type: counts.get(q_type, 0) for q_type in TYPES}, target, list(dict.fromkeys(setups)), seed
+
+
+def _pick(rng, candidates, chosen):
+    '''Returns a random id of candidates that hasn't been chosen, or None'''
+    # Random probes are enough while few candidates are taken, otherwise
+    # fall back to filtering the whole list
+    for _ in range(8):
+        if not candidates:
+            return None
+        id = rng.choice(candidates)
+        if id not in chosen:
+            return id
+    remaining = [id for id in candidates if id not in chosen]
+    return rng.choice(remaining) if remaining else None
+
+
+def select(index, counts, target, setups, seed):
+    '''Returns the ids making up an exam with counts[type] questions of each
+       type that uses every setup in setups, as close to target points as
+       swapping questions of the same type can get it. The same seed and
+       bank always give the same exam. Exception raised if the counts can't
+       be met.'''
+    rng = random.Random(seed)
+    chosen = set()
+    needed = dict(counts)
+    pinned = set()
+
+    # One question per required setup first, of any type that still has room
+    for setup in setups:
+        fitting = [id for id in index.bySetup.get(setup, []) if needed[index.types[id]] > 0 and id not in chosen]
+        if not fitting:
+            raise Exception(f'No question with setup {setup} fits the requested counts.')
+        id = rng.choice(fitting)
+        chosen.add(id)
+        pinned.add(id)
+        needed[index.types[id]] -= 1
+
+    for q_type in TYPES:
+        pool = [id for id in index.byType[q_type] if id not in chosen]
+        if needed[q_type] > len(pool):
+            raise Exception(f'The bank only has {len(index.byType[q_type])} {q_type} questions.')
+        chosen.update(rng.sample(pool, needed[q_type]))
+
+    if target is not None:
+        _balance(rng, index, chosen, pinned, target)
+    return chosen
+
+
+def _balance(rng, index, chosen, pinned, target):
+    '''Swaps chosen questions for others of the same type, always taking
+       the swap that brings the total closest to target, until it is hit or
+       no swap helps. Point values are few, so every swap is weighed by the
+       pair of point values it trades rather than question by question.'''
+    points = index.points
+    total = sum(points[id] for id in chosen)
+    # The chosen questions that may be swapped out, by type and points
+    swappable = {q_type: {} for q_type in TYPES}
+    for id in sorted(chosen - pinned):
+        swappable[index.types[id]].setdefault(points[id], []).append(id)
+
+    for _ in range(MAX_SWAPS):
+        gap = target - total
+        best = None
+        for q_type in TYPES:
+            for out_points, outs in swappable[q_type].items():
+                if not outs:
+                    continue
+                for in_points, candidates in index.byPoints[q_type].items():
+                    change = in_points - out_points
+                    if abs(gap - change) < abs(gap) and (best is None or abs(gap - change) < abs(gap - best[3])):
+                        candidate = _pick(rng, candidates, chosen)
+                        if candidate is not None:
+                            best = (q_type, out_points, candidate, change)
+        if best is None:
+            break
+        q_type, out_points, candidate, change = best
+        outs = swappable[q_type][out_points]
+        out = outs.pop(rng.randrange(len(outs)))
+        chosen.discard(out)
+        chosen.add(candidate)
+        swappable[q_type].setdefault(points[candidate], []).append(candidate)
+        total += change
+
+
+def assemble(constraints):
+    '''Assembles an exam from the body of POST /exam/assemble and returns
+       it with the documents of its questions'''
+    counts, target, setups, seed = parseConstraints(constraints)
+    ids = select(currentIndex(), counts, target, setups, seed)
+    documents = Question.findDocuments(sorted(ids))
+    questions = [documents[id] for q_type in TYPES for id in sorted(ids) if id in documents and documents[id]['type'] == q_type]
+    return {'seed': seed, 'target': target, 'points': sum(question['points'] for question in questions),
+            'questions': questions}
+
+
+def setupBottleRoutes(app):
+    @app.post('/exam/assemble')
+    def postAssemble():
+        '''Picks a random exam meeting the constraints in the request body'''
+        # Parsed here rather than through request.json, whose HTTPError on
+        # a malformed body isn't a message to return
+        try:
+            constraints = json.loads(request.body.read())
+        except ValueError:
+            response.status = 400
+            return "Invalid JSON"
+
+        try:
+            with db.reading():
+                return assemble(constraints)
+        except Exception as err:
+            response.status = 400
+            return err.args
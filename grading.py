@@ -0,0 +1,502 @@
+import functools
+import json
+import re
+import unicodedata
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+import cache
+import db
+import sandbox
+from bottle import response, request
+
+# Automatic grading of student submissions in batches.
+#
+# Multiple choice: the answer key of a question is a bitmap with one bit per
+# option, in id order, set for the true ones. A submission is turned into the
+# same kind of bitmap, so grading it is a few integer operations however many
+# options there are. Keys are cached as (rev, key) in cache.answerKeys and
+# only used while the question is still at that rev.
+#
+# SQL: a query is correct if it gives the same result as the model answer
+# in the question's setup, which sandbox runs it in.
+#
+# Short answer: each rubric of a question is compiled once into a rule that
+# an answer either meets or doesn't, kept with the question's model answer
+# as a RubricMatcher in cache.rubricMatchers at the question's rev, which
+# changes with any of its rubrics.
+
+MAX_SUBMISSIONS = 10000
+# Bytes of a grading request body
+MAX_BODY = 16 * 1024 * 1024
+
+# How a multiple choice submission earns the question's points:
+#   all_or_nothing  all of them for exactly the true options, none otherwise
+#   partial         the share of true options picked, less the share of
+#                   false options picked, never below 0
+#   per_option      the share of options picked or left out correctly
+MC_POLICIES = ('all_or_nothing', 'partial', 'per_option')
+DEFAULT_MC_POLICY = 'all_or_nothing'
+
+
+# Answers longer than this many characters are graded on their start only
+MAX_ANSWER = 10000
+# Share of a plain rubric's words an answer needs to meet it
+COVERAGE = 0.6
+# Similarity to the model answer that earns the points of a question
+# without rubrics
+SIMILARITY = 0.5
+STOPWORDS = frozenset('''a an and are as at be by for from has have in is it its of on or that the this to was were
+                         will with which who what when where why how not no do does than then there these those'''.split())
+# Plurals that add es rather than s
+SIBILANT_PLURALS = ('sses', 'xes', 'ches', 'shes', 'zes')
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+class AnswerKey:
+    '''Answer key of a multiple choice question worth points, with options
+       listed as (id, is_true) in id order'''
+
+    def __init__(self, points, options):
+        self.points = points
+        self.bits = {id: 1 << i for i, (id, is_true) in enumerate(options)}
+        self.correct = sum(self.bits[id] for id, is_true in options if is_true)
+        self.count = len(options)
+        self.trues = _popcount(self.correct)
+
+    def bitmap(self, selected):
+        '''Returns the bitmap of the selected option ids. Exception raised if
+           one of them isn't an option of this question.'''
+        bits = 0
+        for id in selected:
+            if id not in self.bits:
+                raise Exception(f'Option {id} is not an option of this question.')
+            bits |= self.bits[id]
+        return bits
+
+    def score(self, selected, policy):
+        '''Returns the points the selected option bitmap earns under policy'''
+        if policy == 'all_or_nothing':
+            return self.points if selected == self.correct else 0
+        if policy == 'partial':
+            falses = self.count - self.trues
+            hits = _popcount(selected & self.correct) / self.trues if self.trues else 1
+            misses = _popcount(selected & ~self.correct) / falses if falses else 0
+            return round(max(0, hits - misses) * self.points, 4)
+        wrong = _popcount(selected ^ self.correct)
+        return round((self.count - wrong) / self.count * self.points, 4) if self.count else self.points
+
+
+def _current(cursor, qids, q_type, store):
+    '''Returns the values store holds for those of the qids of a question of
+       q_type at its current rev, and the rows of the others, as ({qid:
+       value}, {qid: row})'''
+    current = {}
+    stale = {}
+    qids = list(qids)
+    for start in range(0, len(qids), db.MAX_PARAMS):
+        chunk = qids[start:start + db.MAX_PARAMS]
+        cursor.execute(f"SELECT id, points, answer, rev FROM Question WHERE type = ? AND id IN ({', '.join('?' * len(chunk))})",
+                       [q_type] + chunk)
+        for row in cursor.fetchall():
+            entry = store.get(row['id'])
+            if entry is not None and entry[0] == row['rev']:
+                current[row['id']] = entry[1]
+            else:
+                stale[row['id']] = row
+    return current, stale
+
+
+def answerKeys(qids):
+    '''Returns a dict mapping each of the qids of a multiple choice question
+       to its AnswerKey, loading the ones that aren't cached at the
+       question's current rev with one query for all of them'''
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        keys, stale = _current(cursor, qids, 'mc', cache.answerKeys)
+        options = {qid: [] for qid in stale}
+        stale_ids = list(stale)
+        for start in range(0, len(stale_ids), db.MAX_PARAMS):
+            chunk = stale_ids[start:start + db.MAX_PARAMS]
+            cursor.execute(f"SELECT id, is_true, qid FROM MCOption WHERE qid IN ({', '.join('?' * len(chunk))}) ORDER BY qid, id", chunk)
+            for row in cursor:
+                options[row['qid']].append((row['id'], bool(row['is_true'])))
+
+    for qid, row in stale.items():
+        keys[qid] = AnswerKey(row['points'], options[qid])
+        cache.answerKeys.put(qid, (row['rev'], keys[qid]))
+    return keys
+
+
+@functools.lru_cache(maxsize=65536)
+def _stem(word):
+    '''Cuts common suffixes off word, so that "table" and "tables", "query"
+       and "queries", or "join", "joins", "joined" and "joining" are the
+       same word'''
+    if word in STOPWORDS or len(word) <= 3:
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        word = word[:-3] + 'y'
+    elif word.endswith(SIBILANT_PLURALS):
+        word = word[:-2]
+    elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+    if word.endswith('ing') and len(word) >= 6:
+        word = word[:-3]
+    elif word.endswith('ed') and len(word) >= 5:
+        word = word[:-2]
+    # "combine" and "combined" both end up as "combin"
+    if word.endswith('e') and len(word) >= 4:
+        word = word[:-1]
+    return word
+
+
+def tokens(text):
+    '''Returns the words of text, case folded and stemmed'''
+    return [_stem(word) for word in re.findall(r'\w+', unicodedata.normalize('NFKC', text).casefold())]
+
+
+def ngrams(words):
+    '''Returns the set of words and pairs of consecutive words of words,
+       leaving out stopwords'''
+    words = [word for word in words if word not in STOPWORDS]
+    return set(words) | set(zip(words, words[1:]))
+
+
+def _nestedQuantifier(parsed, repeated=False):
+    '''True if a part of the parsed pattern that may repeat holds another
+       part that may repeat, like (a+)+, which can take exponential
+       time to fail a match'''
+    for op, av in parsed:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, item = av
+            # A fixed count like {3} inside a repeat is no worse than
+            # writing it out
+            if repeated and low != high:
+                return True
+            if _nestedQuantifier(item, repeated or high > 1):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if _nestedQuantifier(av[-1], repeated):
+                return True
+        elif op == sre_parse.BRANCH:
+            if any(_nestedQuantifier(item, repeated) for item in av[1]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if _nestedQuantifier(av[1], repeated):
+                return True
+    return False
+
+
+class Rule:
+    '''What an answer needs to meet a rubric, taken from its text: a /regular
+       expression/ it must match, "quoted" phrases it must all contain, or
+       else most of the rubric's words'''
+
+    def __init__(self, rubric_text):
+        rubric_text = rubric_text or ''
+        pattern = re.fullmatch(r'\s*/(.+)/\s*', rubric_text, re.S)
+        phrases = re.findall(r'"([^"]+)"', rubric_text)
+        self.pattern = None
+        self.phrases = None
+        self.words = None
+        if pattern:
+            try:
+                self.pattern = re.compile(pattern.group(1), re.I)
+            except re.error as err:
+                raise Exception(f'Rubric pattern /{pattern.group(1)}/ is not a valid regular expression: {err}')
+            if _nestedQuantifier(sre_parse.parse(pattern.group(1), re.I)):
+                raise Exception(f'Rubric pattern /{pattern.group(1)}/ repeats something that repeats itself, which can take forever to match.')
+        elif phrases:
+            self.phrases = [' ' + ' '.join(tokens(phrase)) + ' ' for phrase in phrases]
+        else:
+            self.words = frozenset(tokens(rubric_text)) - STOPWORDS
+
+    def met(self, text, joined, words):
+        '''True if the answer meets the rule, given as its text, its tokens
+           joined by spaces with one on either end, and its set of tokens'''
+        if self.pattern is not None:
+            return self.pattern.search(text) is not None
+        if self.phrases is not None:
+            return all(phrase in joined for phrase in self.phrases)
+        return not self.words or len(self.words & words) >= COVERAGE * len(self.words)
+
+
+class RubricMatcher:
+    '''The rules of a short answer question's rubrics, listed as (id,
+       rubric_text, points), and the n-grams of its model answer'''
+
+    def __init__(self, points, answer, rubrics):
+        self.points = points
+        self.model = ngrams(tokens(answer or ''))
+        self.rubrics = [(id, points, Rule(rubric_text)) for id, rubric_text, points in rubrics]
+
+    def similarity(self, grams):
+        '''Dice coefficient of the n-grams of an answer and the model answer'''
+        if not grams and not self.model:
+            return 1.0
+        return 2 * len(grams & self.model) / (len(grams) + len(self.model))
+
+    def score(self, text):
+        '''Returns {"score", "similarity", "rubrics"}: the points awarded for
+           the answer text, its similarity to the model answer, and {"id",
+           "points", "awarded"} for each rubric'''
+        text = text[:MAX_ANSWER]
+        words = tokens(text)
+        joined = ' ' + ' '.join(words) + ' '
+        present = set(words)
+        similarity = self.similarity(ngrams(words))
+        rubrics = [{'id': id, 'points': points, 'awarded': points if rule.met(text, joined, present) else 0}
+                   for id, points, rule in self.rubrics]
+        if rubrics:
+            awarded = sum(rubric['awarded'] for rubric in rubrics)
+        else:
+            awarded = self.points if similarity >= SIMILARITY else 0
+        return {'score': awarded, 'similarity': round(similarity, 4), 'rubrics': rubrics}
+
+
+def rubricMatchers(qids):
+    '''Returns a dict mapping each of the qids of a short answer question to
+       its RubricMatcher, or to the Exception that kept it from being built,
+       loading the ones that aren't cached at the question's current rev
+       with one query for all of them'''
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        matchers, stale = _current(cursor, qids, 'sa', cache.rubricMatchers)
+        rubrics = {qid: [] for qid in stale}
+        stale_ids = list(stale)
+        for start in range(0, len(stale_ids), db.MAX_PARAMS):
+            chunk = stale_ids[start:start + db.MAX_PARAMS]
+            cursor.execute(f"SELECT id, rubric_text, points, qid FROM Rubric WHERE qid IN ({', '.join('?' * len(chunk))}) ORDER BY qid, id", chunk)
+            for row in cursor:
+                rubrics[row['qid']].append((row['id'], row['rubric_text'], row['points']))
+
+    for qid, row in stale.items():
+        try:
+            matchers[qid] = RubricMatcher(row['points'], row['answer'], rubrics[qid])
+        except Exception as err:
+            matchers[qid] = err
+        cache.rubricMatchers.put(qid, (row['rev'], matchers[qid]))
+    return matchers
+
+
+def gradeMC(submissions, policy=DEFAULT_MC_POLICY):
+    '''Grades a list of {"student", "qid", "selected"} submissions, selected
+       being the ids of the options the student picked. Returns a result for
+       each, with the points earned or the error that kept it from being
+       graded, and each student's total.'''
+    keys = answerKeys({submission['qid'] for submission in submissions
+                       if isinstance(submission, dict) and isinstance(submission.get('qid'), int)})
+    results = []
+    totals = {}
+    for submission in submissions:
+        result = {}
+        results.append(result)
+        try:
+            if not isinstance(submission, dict):
+                raise Exception(f'Expected a JSON object with student, qid and selected.')
+            result['student'] = submission['student']
+            result['qid'] = submission['qid']
+            key = keys.get(submission['qid'])
+            if key is None:
+                raise Exception(f"No such multiple choice Question with id: {submission['qid']}")
+            if not isinstance(submission['selected'], list):
+                raise Exception(f'selected must be a list of option ids.')
+            selected = key.bitmap(submission['selected'])
+        except KeyError as err:
+            result['error'] = f'Missing field: {err.args[0]}'
+            continue
+        except Exception as err:
+            result['error'] = str(err)
+            continue
+
+        result['score'] = key.score(selected, policy)
+        result['points'] = key.points
+        result['correct'] = selected == key.correct
+        student = str(submission['student'])
+        totals[student] = totals.get(student, 0) + result['score']
+    return {'policy': policy, 'results': results, 'totals': totals}
+
+
+def gradeSQL(submissions):
+    '''Grades a list of {"student", "qid", "query"} submissions, query
+       being the student's SQL. Returns a result for each, with the points
+       earned or the error that kept it from being graded, and each
+       student's total.'''
+    qids = list({submission['qid'] for submission in submissions
+                 if isinstance(submission, dict) and isinstance(submission.get('qid'), int)})
+    questions = {}
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(qids), db.MAX_PARAMS):
+            chunk = qids[start:start + db.MAX_PARAMS]
+            cursor.execute(f"""SELECT Question.id, Question.points, Question.rev, Question.answer,
+                                      Setup.id AS setup, Setup.rev AS setup_rev, Setup.setup_text
+                               FROM Question JOIN Setup ON Setup.id = Question.setup
+                               WHERE Question.type = 'sql' AND Question.id IN ({', '.join('?' * len(chunk))})""", chunk)
+            for row in cursor:
+                questions[row['id']] = row
+
+    results = []
+    queries = {}
+    for submission in submissions:
+        result = {}
+        results.append(result)
+        try:
+            if not isinstance(submission, dict):
+                raise Exception(f'Expected a JSON object with student, qid and query.')
+            result['student'] = submission['student']
+            result['qid'] = submission['qid']
+            if submission['qid'] not in questions:
+                raise Exception(f"No such SQL Question with id: {submission['qid']}")
+            if not isinstance(submission['query'], str):
+                raise Exception(f'query must be a string of SQL.')
+            queries.setdefault(submission['qid'], []).append((result, submission['query']))
+        except KeyError as err:
+            result['error'] = f'Missing field: {err.args[0]}'
+        except Exception as err:
+            result['error'] = str(err)
+
+    # Queries of the same question go out in chunks, so their model answer
+    # and sandbox are reused within each one
+    tasks = []
+    waiting = []
+    for qid, pending in queries.items():
+        row = questions[qid]
+        for start in range(0, len(pending), sandbox.CHUNK_SIZE):
+            chunk = pending[start:start + sandbox.CHUNK_SIZE]
+            tasks.append((sandbox.prepareSQL, ((row['setup'], row['setup_rev']), row['setup_text'], (qid, row['rev'], row['setup_rev']),
+                          row['answer']), sandbox.checkSQL, [query for result, query in chunk]))
+            waiting.append(chunk)
+
+    totals = {}
+    for chunk, graded in zip(waiting, sandbox.gradeAll(tasks)):
+        for (result, query), outcome in zip(chunk, graded):
+            if 'error' in outcome:
+                result['error'] = outcome['error']
+                continue
+            points = questions[result['qid']]['points']
+            result['score'] = points if outcome['correct'] else 0
+            result['points'] = points
+            result['correct'] = outcome['correct']
+            student = str(result['student'])
+            totals[student] = totals.get(student, 0) + result['score']
+    return {'results': results, 'totals': totals}
+
+
+def gradeSA(submissions):
+    '''Grades a list of {"student", "qid", "answer"} submissions against the
+       rubrics of their questions. Returns a result for each, with the points
+       awarded for every rubric or the error that kept it from being graded,
+       and each student's total.'''
+    matchers = rubricMatchers({submission['qid'] for submission in submissions
+                               if isinstance(submission, dict) and isinstance(submission.get('qid'), int)})
+    results = []
+    answers = {}
+    for submission in submissions:
+        result = {}
+        results.append(result)
+        try:
+            if not isinstance(submission, dict):
+                raise Exception(f'Expected a JSON object with student, qid and answer.')
+            result['student'] = submission['student']
+            result['qid'] = submission['qid']
+            matcher = matchers.get(submission['qid'])
+            if matcher is None:
+                raise Exception(f"No such short answer Question with id: {submission['qid']}")
+            if isinstance(matcher, Exception):
+                raise matcher
+            if not isinstance(submission['answer'], str):
+                raise Exception(f'answer must be a string.')
+            answers.setdefault(submission['qid'], []).append((result, submission['answer'][:MAX_ANSWER]))
+        except KeyError as err:
+            result['error'] = f'Missing field: {err.args[0]}'
+        except Exception as err:
+            result['error'] = str(err)
+
+    # Rubric patterns are matched against what students wrote, which a
+    # pattern can take any time over, so answers are scored in the sandbox
+    # workers like SQL queries, with the matcher sent along ready to use
+    tasks = []
+    waiting = []
+    for qid, pending in answers.items():
+        for start in range(0, len(pending), sandbox.CHUNK_SIZE):
+            chunk = pending[start:start + sandbox.CHUNK_SIZE]
+            tasks.append((sandbox.ready, (matchers[qid],), RubricMatcher.score, [answer for result, answer in chunk]))
+            waiting.append(chunk)
+
+    totals = {}
+    for chunk, scored in zip(waiting, sandbox.gradeAll(tasks)):
+        for (result, answer), outcome in zip(chunk, scored):
+            if 'error' in outcome:
+                result['error'] = outcome['error']
+                continue
+            result.update(outcome)
+            result['points'] = matchers[result['qid']].points
+            student = str(result['student'])
+            totals[student] = totals.get(student, 0) + result['score']
+    return {'results': results, 'totals': totals}
+
+
+def _submissions():
+    '''Returns the body of a grading request and its submissions list.
+       Exception raised if there isn't one. The body is read directly, as
+       request.json turns away anything over MEMFILE_MAX, which a class
+       worth of submissions easily is.'''
+    if request.content_length > MAX_BODY:
+        raise Exception(f'A grading request can be at most {MAX_BODY} bytes.')
+    try:
+        data = json.loads(request.body.read())
+    except ValueError:
+        raise Exception(f'Expected a JSON object with a list of submissions.')
+    submissions = data.get('submissions') if isinstance(data, dict) else None
+    if not isinstance(submissions, list):
+        raise Exception(f'Expected a JSON object with a list of submissions.')
+    if len(submissions) > MAX_SUBMISSIONS:
+        raise Exception(f'At most {MAX_SUBMISSIONS} submissions can be graded at once.')
+    return data, submissions
+
+
+def setupBottleRoutes(app):
+    @app.post('/grade/mc')
+    def postGradeMC():
+        '''Grades a batch of multiple choice submissions'''
+        try:
+            data, submissions = _submissions()
+            policy = data.get('policy', DEFAULT_MC_POLICY)
+            if policy not in MC_POLICIES:
+                raise Exception(f'policy must be one of {", ".join(MC_POLICIES)}.')
+        except Exception as err:
+            response.status = 400
+            return err.args
+
+        with db.reading():
+            return gradeMC(submissions, policy)
+
+    @app.post('/grade/sql')
+    def postGradeSQL():
+        '''Grades a batch of SQL submissions by running them'''
+        try:
+            data, submissions = _submissions()
+        except Exception as err:
+            response.status = 400
+            return err.args
+
+        with db.reading():
+            return gradeSQL(submissions)
+
+    @app.post('/grade/sa')
+    def postGradeSA():
+        '''Grades a batch of short answer submissions against their rubrics'''
+        try:
+            data, submissions = _submissions()
+        except Exception as err:
+            response.status = 400
+            return err.args
+
+        with db.reading():
+            return gradeSA(submissions)
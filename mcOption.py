@@ -1,9 +1,18 @@
+import cache
 import db
-import json
+import etag
+import paging
+import prerender
+import serializer
+import streaming
+import writer
 from bottle import response, request
 
 class MCOption:
 
+    # Columns a page of the index can be projected onto with ?fields=
+    PAGE_COLUMNS = {'id': 'id', 'is_true': 'is_true', 'option_text': 'option_text', 'qid': 'qid'}
+
     def __init__(self, id, is_true, option_text, qid):
         '''Constructor'''
         self.id = id
@@ -17,7 +26,8 @@ class MCOption:
             cursor = conn.cursor()
             cursor.execute("UPDATE MCOption SET is_true = ?, option_text = ?, qid = ? WHERE id = ?",
                                (1 if self.is_true else 0, self.option_text, self.qid, self.id))
-            conn.commit()
+            prerender.refresh([self.qid])
+        cache.documents.invalidate(self.qid)
         
     def updateFromJSON(self, mc_data):
         '''Unpack JSON representation to update instance variables and then
@@ -25,8 +35,13 @@ class MCOption:
         
         self.is_true = mc_data['is_true']
         self.option_text = mc_data['option_text']
+        old_qid = self.qid
         self.qid = mc_data['qid']
-        self.update()
+        with db.connect():
+            self.update()
+            prerender.refresh([old_qid])
+        # The option may have moved to another question, which changes both
+        cache.documents.invalidate(old_qid)
 
     def delete(self):
         '''Deletes instance from database, any object representations of the
@@ -34,6 +49,8 @@ class MCOption:
         with db.connect() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM MCOption WHERE id = ?", (self.id, ))
+            prerender.refresh([self.qid])
+        cache.documents.invalidate(self.qid)
 
     
     def jsonable(self):
@@ -58,7 +75,8 @@ class MCOption:
             cursor = conn.cursor()
             cursor.execute("INSERT INTO MCOption (is_true, option_text, qid) VALUES (?, ?, ?)",
                                (1 if is_true else 0, option_text, qid))
-            conn.commit()
+            prerender.refresh([qid])
+        cache.documents.invalidate(qid)
         return MCOption.find(cursor.lastrowid)
 
     @staticmethod
@@ -80,20 +98,45 @@ class MCOption:
     def getAllIDs():        
         with db.connect() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT id FROM MCOption")
+            cursor.execute("SELECT id FROM MCOption ORDER BY id")
             all_ids = [row['id'] for row in cursor]
         return all_ids
         
+    @staticmethod
+    def getPage(after, limit, fields):
+        '''Returns the page of MCOption rows with id greater than after'''
+        page = paging.fetch('MCOption', MCOption.PAGE_COLUMNS, fields, after, limit)
+        if 'is_true' in fields:
+            for item in page['items']:
+                item['is_true'] = bool(item['is_true'])
+        return page
+
     @staticmethod
     def setupBottleRoutes(app):
         @app.get('/mc_option')
         def getMCOptionIndex():
+            etag.check(db.revision('MCOption'))
+            if paging.requested(request.query):
+                try:
+                    after, limit, fields = paging.parse(request.query, MCOption.PAGE_COLUMNS, ['id'])
+                except Exception as err:
+                    response.status = 400
+                    return err.args
+                return MCOption.getPage(after, limit, fields)
+
+            if streaming.requested(request.query):
+                response.content_type = 'application/json'
+                return streaming.jsonArray("SELECT id FROM MCOption ORDER BY id", (), lambda row: row['id'])
+
             mc_option_index = MCOption.getAllIDs()
             response.content_type = 'application/json'
-            return json.dumps(mc_option_index)
+            return serializer.dumps(mc_option_index)
             
         @app.get('/mc_option/<id>')
         def getMCOption(id):
+            rev = db.revision('MCOption', id)
+            if rev is not None:
+                etag.check(rev)
             try:
                 mc_option = MCOption.find(id)
             except Exception:
@@ -104,7 +147,7 @@ class MCOption:
         @app.post('/mc_option')
         def postMCOption():
 
-            mc_option = MCOption.createFromJSON(request.json)
+            mc_option = writer.run(MCOption.createFromJSON, request.json)
             return mc_option.jsonable()
 
         @app.put('/mc_option/<id>')
@@ -117,7 +160,7 @@ class MCOption:
                 response.status = 404
                 return f"Multiple choice option {id} to update not found"
 
-            mc_option.updateFromJSON(request.json)
+            writer.run(mc_option.updateFromJSON, request.json)
             return mc_option.jsonable()
 
         @app.delete('/mc_option/<id>')
@@ -130,8 +173,8 @@ class MCOption:
                 response.status = 404
                 return f"Multiple choice option {id} to delete does not exist"
 
-            mc_option.delete()
+            writer.run(mc_option.delete)
     
             response.content_type = 'application/json'
-            return json.dumps(True)
+            return serializer.dumps(True)
 
@@ -0,0 +1,50 @@
+import db
+
+# Keyset pagination for the index endpoints. A page is requested with
+# ?after=<id>&limit=<n>&fields=<a,b,...> and comes back as
+# {"items": [...], "next": <id to pass as after> | null}.
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+PARAMS = ('after', 'limit', 'fields')
+
+
+def requested(query, extra=()):
+    '''Returns True if the query string asks for a page instead of the
+       whole index'''
+    return any(name in query for name in PARAMS + tuple(extra))
+
+
+def parse(query, columns, default_fields):
+    '''Reads after, limit and fields from the query string. Fields must be
+       keys of columns. Exception raised if a parameter is invalid.'''
+    try:
+        after = int(query.get('after', 0))
+        limit = int(query.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise Exception(f'after and limit must be integers.')
+    if (limit < 1 or limit > MAX_LIMIT):
+        raise Exception(f'limit must be between 1 and {MAX_LIMIT}.')
+
+    fields = query.get('fields')
+    fields = fields.split(',') if fields else list(default_fields)
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise Exception(f'Unknown fields: {", ".join(unknown)}')
+    return after, limit, fields
+
+
+def fetch(table, columns, fields, after, limit, where='', params=()):
+    '''Returns the page of rows of table with id greater than after,
+       projected onto fields. columns maps each field to the SQL expression
+       selecting it, and where/params optionally filter the rows further.'''
+    select = ', '.join(f'{columns[field]} AS {field}' for field in fields)
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id AS cursor_id, {select} FROM {table} WHERE id > ? {where} ORDER BY id LIMIT ?",
+                       (after, *params, limit + 1))
+        rows = cursor.fetchall()
+
+    items = [{field: row[field] for field in fields} for row in rows[:limit]]
+    next = rows[limit - 1]['cursor_id'] if len(rows) > limit else None
+    return {'items': items, 'next': next}
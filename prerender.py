@@ -0,0 +1,58 @@
+import db
+import serializer
+
+# Optional storage mode that keeps the detail document of every question
+# serialized in QuestionDocument, so GET /question/<qid> is one primary key
+# lookup whose bytes are sent as they are. Every write re-renders the
+# documents it touches in its own transaction. A stored document is stamped
+# with the rev of the question it was rendered from and is only served while
+# the question is still at that rev, so one left behind by a write made with
+# the mode off is rendered again on its next read instead.
+
+enabled = False
+
+# Function returning {id: (rev, document)} for a list of question ids without
+# going through the document cache, set by question.py
+build = None
+
+
+def configure(enable=True):
+    '''Turns pre-rendered documents on or off. Documents stored while it was
+       off are rendered on their first read.'''
+    global enabled
+    enabled = enable
+
+
+def refresh(ids):
+    '''Renders and stores the documents of the questions with these ids,
+       removing those of questions that no longer exist. Call it inside the
+       transaction that changed them, so the documents are committed or
+       rolled back along with the change.'''
+    if not enabled:
+        return
+    ids = list({int(id) for id in ids if id is not None})
+    if not ids:
+        return
+
+    with db.connect() as conn:
+        for start in range(0, len(ids), db.MAX_PARAMS):
+            chunk = ids[start:start + db.MAX_PARAMS]
+            rendered = build(chunk)
+            conn.executemany("INSERT OR REPLACE INTO QuestionDocument (id, rev, body) VALUES (?, ?, ?)",
+                             [(id, rev, serializer.dumpb(document)) for id, (rev, document) in rendered.items()])
+            conn.executemany("DELETE FROM QuestionDocument WHERE id = ?",
+                             [(id,) for id in chunk if id not in rendered])
+
+
+def load(id):
+    '''Returns (rev, body) for the question with the specified id, where body
+       is the stored document or None if it is missing or out of date. None
+       if there is no such question.'''
+    with db.connect() as conn:
+        row = conn.execute("""SELECT Question.rev, QuestionDocument.rev AS body_rev, QuestionDocument.body
+                              FROM Question
+                              LEFT JOIN QuestionDocument ON QuestionDocument.id = Question.id
+                              WHERE Question.id = ?""", (id,)).fetchone()
+    if row is None:
+        return None
+    return row['rev'], (row['body'] if row['body_rev'] == row['rev'] else None)
@@ -1,11 +1,28 @@
+import cache
 import db
+import etag
+import itertools
 import json
+import paging
+import prerender
+import serializer
+import streaming
+import writer
 from bottle import response, request
 from mcOption import MCOption
 from rubric import Rubric
 
+# Length of the question_start blurb shown in the question index
+BLURB_LENGTH = 40
+
 class Question:
 
+    # Columns a page of the index can be projected onto with ?fields=
+    PAGE_COLUMNS = {'id': 'id', 'type': 'type', 'question_start': f'SUBSTRING(question_text, 1, {BLURB_LENGTH})',
+                    'question_text': 'question_text', 'points': 'points', 'setup': 'setup', 'answer': 'answer'}
+    # The subset of those fields that QuestionDigest holds
+    DIGEST_COLUMNS = {'id': 'id', 'type': 'type', 'question_start': 'blurb'}
+
     def __init__(self, id, q_type, question_text, points, setup, answer):
         '''Constructor'''
         self.id = id
@@ -21,7 +38,10 @@ class Question:
             cursor = conn.cursor()
             cursor.execute("UPDATE Question SET question_text = ?, points = ?, setup = ?, answer = ? WHERE id = ?",
                 (self.question_text, self.points, self.setup, self.answer, self.id))
-            conn.commit()
+            cursor.execute("UPDATE QuestionDigest SET blurb = ? WHERE id = ?",
+                (self.question_text[:BLURB_LENGTH], self.id))
+            prerender.refresh([self.id])
+        cache.documents.invalidate(self.id)
     
     def updateFromJSON(self, question_data):
         '''Unpack JSON representation to update instance variables and then
@@ -40,68 +60,59 @@ class Question:
         '''Deletes instance from database, any object representations of the
            instance are now invalid and shouldn't be used including this one'''
 
-        if (self.type == 'mc'):
-            with db.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM Question WHERE id =?", (self.id, ))
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM Question WHERE id =?", (self.id, ))
+            cursor.execute("DELETE FROM QuestionDigest WHERE id =?", (self.id, ))
+            if (self.type == 'mc'):
                 cursor.execute("DELETE FROM MCOption WHERE qid =?", (self.id,))
-        
-        if (self.type == 'sa'):
-            with db.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM Question WHERE id =?", (self.id, ))
+            if (self.type == 'sa'):
                 cursor.execute("DELETE FROM Rubric WHERE qid =?", (self.id,))
-        if (self.type == 'sql'):
-            with db.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM Question WHERE id =?", (self.id, ))
+            prerender.refresh([self.id])
+        cache.documents.invalidate(self.id)
     
-    def jsonable(self):
+    def jsonable(self, options=None, rubrics=None):
         '''Returns a dict appropriate for creating JSON representation
-           of the instance'''
+           of the instance. Options or rubrics that were already loaded can
+           be passed in to skip looking them up again.'''
 
-        
-        
         if (self.type == 'sql'):
             return {'id': self.id, 'type': "sql", 'question_text': self.question_text, 'points': self.points, 'setup': self.setup, 'answer': self.answer}
         
         if (self.type == 'mc'):
+            if options is None:
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT * FROM MCOption WHERE qid = ? ORDER BY id", (self.id, ))
+                    options = [MCOption(row['id'], bool(row['is_true']), row['option_text'], row['qid']) for row in cursor]
+
             true_options = []
             false_options = []
-            with db.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM MCOption WHERE qid = ? AND is_true = ?", (self.id, 1))
-                for row in cursor:
-                    true_options.append(MCOption(row['id'], bool(row['is_true']), row['option_text'], row['qid']).jsonable()) 
-            
-            with db.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM MCOption WHERE qid = ? AND is_true = ?", (self.id, 0))
-                for row in cursor:
-                    false_options.append(MCOption(row['id'], bool(row['is_true']), row['option_text'], row['qid']).jsonable())
+            for option in options:
+                if option.is_true:
+                    true_options.append(option.jsonable())
+                else:
+                    false_options.append(option.jsonable())
             
             return {'id': self.id, 'type': "mc", 'question_text': self.question_text, 'points': self.points, 'setup': self.setup, 'true_options': true_options , 'false_options': false_options} 
 
         if (self.type == 'sa'):
-            rubrics = []
-            with db.connect() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM Rubric WHERE qid = ?", (self.id, ))
-                for row in cursor:
-                    rubrics.append(Rubric(row['id'], row['rubric_text'], row['points'], row['qid']).jsonable())
+            if rubrics is None:
+                with db.connect() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT * FROM Rubric WHERE qid = ? ORDER BY id", (self.id, ))
+                    rubrics = [Rubric(row['id'], row['rubric_text'], row['points'], row['qid']) for row in cursor]
             
-            return {'id': self.id, 'type': "sa", 'question_text': self.question_text, 'points': self.points, 'setup': self.setup, 'answer': self.answer, 'rubrics': rubrics}
+            return {'id': self.id, 'type': "sa", 'question_text': self.question_text, 'points': self.points, 'setup': self.setup, 'answer': self.answer, 'rubrics': [rubric.jsonable() for rubric in rubrics]}
 
     
 
     @staticmethod
-    def createFromJSON(question_data):
-        '''Creates new instance object using dict created from JSON representation
-           using create'''
-        
-        # Unpack the instance data from JSON
-        # Should validate information here and throw exception
-        # if something is not right.
+    def validate(question_data):
+        '''Checks dict created from JSON representation against the rules for
+           a new question and returns the (type, question_text, points, setup,
+           answer) values to store. Exception raised if something is not right.'''
+
         q_type = question_data['type']
         question_text = question_data['question_text']
         points = question_data['points']
@@ -128,13 +139,155 @@ class Question:
             if (answer == '' or answer.isspace()):
                 raise Exception(f'Answer must be filled in for this question.')
 
-        
-        with db.connect() as conn:
+        return q_type, question_text, points, setup, answer
+
+    @staticmethod
+    def validateEmbedded(q_type, question_data):
+        '''Checks the "options", "rubrics" and "setup" object a new question
+           of q_type may embed and returns its (options, rubrics). Exception
+           raised if something is not right.'''
+
+        options = question_data.get('options') or []
+        rubrics = question_data.get('rubrics') or []
+        if (not isinstance(options, list) or any(not isinstance(option, dict) for option in options)):
+            raise Exception(f'options must be a list of JSON objects.')
+        if (not isinstance(rubrics, list) or any(not isinstance(rubric, dict) for rubric in rubrics)):
+            raise Exception(f'rubrics must be a list of JSON objects.')
+        if (options and q_type != 'mc'):
+            raise Exception(f'Only multiple choice questions have options.')
+        if (rubrics and q_type != 'sa'):
+            raise Exception(f'Only short answer questions have rubrics.')
+
+        embedded = [(option, ('is_true', 'option_text')) for option in options]
+        embedded += [(rubric, ('rubric_text', 'points')) for rubric in rubrics]
+        if isinstance(question_data['setup'], dict):
+            embedded.append((question_data['setup'], ('setup_text',)))
+        for data, fields in embedded:
+            for field in fields:
+                if field not in data:
+                    raise KeyError(field)
+        return options, rubrics
+
+    @staticmethod
+    def insert(cursor, question_data):
+        '''Validates dict created from JSON representation and inserts the
+           question with cursor, returning its id. The question may embed its
+           "options" or "rubrics" and give its "setup" as an object instead of
+           an id, which are all inserted along with it.'''
+
+        q_type, question_text, points, setup, answer = Question.validate(question_data)
+        options, rubrics = Question.validateEmbedded(q_type, question_data)
+
+        if isinstance(setup, dict):
+            cursor.execute("INSERT INTO Setup (setup_text) VALUES (?)", (setup['setup_text'],))
+            setup = cursor.lastrowid
+        cursor.execute("INSERT INTO Question (type, question_text, points, setup, answer) VALUES (?, ?, ?, ?, ?)",
+                (q_type, question_text, points, setup, answer))
+        id = cursor.lastrowid
+        cursor.execute("INSERT INTO QuestionDigest (id, type, blurb) VALUES (?, ?, ?)",
+                (id, q_type, question_text[:BLURB_LENGTH]))
+        cursor.executemany("INSERT INTO MCOption (is_true, option_text, qid) VALUES (?, ?, ?)",
+                [(1 if option['is_true'] else 0, option['option_text'], id) for option in options])
+        cursor.executemany("INSERT INTO Rubric (rubric_text, points, qid) VALUES (?, ?, ?)",
+                [(rubric['rubric_text'], rubric['points'], id) for rubric in rubrics])
+        prerender.refresh([id])
+        return id
+
+    @staticmethod
+    def createFromJSON(question_data):
+        '''Creates new instance object using dict created from JSON representation
+           using create, along with anything it embeds, in one transaction'''
+
+        with db.transaction() as conn:
+            id = Question.insert(conn.cursor(), question_data)
+        cache.documents.invalidate(id)
+        return Question.find(id)
+
+    @staticmethod
+    def bulkFromJSON(operations):
+        '''Validates a list of create, update and delete operations, each a
+           dict created from JSON representation with an "op" key, and only if
+           all of them are valid applies them in order in a single
+           transaction. Returns (True, results) with the id each operation
+           touched, or (False, results) with the error of each invalid one.'''
+
+        # The id of each update and delete that has one, as an int like the
+        # <qid> of the routes, looked up all at once
+        ids = {}
+        for i, operation in enumerate(operations):
+            if isinstance(operation, dict) and operation.get('op') in ('update', 'delete'):
+                try:
+                    ids[i] = int(str(operation['id']))
+                except (KeyError, ValueError):
+                    pass
+        existing = Question.findTypes(set(ids.values()))
+        results = []
+        planned = []
+        for i, operation in enumerate(operations):
+            op = operation.get('op', 'create') if isinstance(operation, dict) else None
+            result = {'op': op, 'status': 200}
+            results.append(result)
+            try:
+                if op == 'create':
+                    q_type = Question.validate(operation)[0]
+                    Question.validateEmbedded(q_type, operation)
+                    planned.append(('create', operation, result))
+                    continue
+                if op not in ('update', 'delete'):
+                    raise Exception(f'Operation must be a JSON object with op create, update or delete.')
+
+                result['id'] = operation['id']
+                if i not in ids:
+                    raise Exception(f'id must be an integer.')
+                id = result['id'] = ids[i]
+                if id not in existing:
+                    result['status'] = 404
+                    raise Exception(f'No such Question with id: {id}')
+                if op == 'update':
+                    if (operation['type'] != existing[id]):
+                        raise Exception(f'Type cannot be changed.')
+                    q_type, question_text, points, setup, answer = Question.validate(operation)
+                    planned.append(('update', (question_text, points, setup, answer, id), result))
+                else:
+                    del existing[id]
+                    planned.append(('delete', (id,), result))
+            except KeyError as err:
+                result['status'] = 400
+                result['error'] = f'Missing field: {err.args[0]}'
+            except Exception as err:
+                if result['status'] == 200:
+                    result['status'] = 400
+                result['error'] = str(err)
+
+        if any(result['status'] != 200 for result in results):
+            return False, results
+
+        with db.transaction() as conn:
             cursor = conn.cursor()
-            cursor.execute("INSERT INTO Question (type, question_text, points, setup, answer) VALUES (?, ?, ?, ?, ?)",
-                    (q_type, question_text, points, setup, answer))
-            conn.commit()
-        return Question.find(cursor.lastrowid)
+            # Consecutive updates and deletes go to SQLite as one executemany,
+            # which keeps the order the operations were given in. Creates go
+            # through insert, one by one, with anything they embed.
+            for op, run in itertools.groupby(planned, key=lambda item: item[0]):
+                run = list(run)
+                if (op == 'create'):
+                    for _, question_data, result in run:
+                        result['id'] = Question.insert(cursor, question_data)
+                if (op == 'update'):
+                    rows = [row for _, row, _ in run]
+                    cursor.executemany("UPDATE Question SET question_text = ?, points = ?, setup = ?, answer = ? WHERE id = ?",
+                                       rows)
+                    cursor.executemany("UPDATE QuestionDigest SET blurb = ? WHERE id = ?",
+                                       [(row[0][:BLURB_LENGTH], row[4]) for row in rows])
+                if (op == 'delete'):
+                    rows = [row for _, row, _ in run]
+                    cursor.executemany("DELETE FROM Question WHERE id = ?", rows)
+                    cursor.executemany("DELETE FROM QuestionDigest WHERE id = ?", rows)
+                    cursor.executemany("DELETE FROM MCOption WHERE qid = ?", rows)
+                    cursor.executemany("DELETE FROM Rubric WHERE qid = ?", rows)
+            prerender.refresh(result['id'] for op, row, result in planned)
+        for op, row, result in planned:
+            cache.documents.invalidate(result['id'])
+        return True, results
         
     @staticmethod
     def find(id):
@@ -151,54 +304,256 @@ class Question:
         else:
             return Question(row['id'], row['type'], row['question_text'], row['points'], row['setup'], row['answer'])
     
+    @staticmethod
+    def findTypes(ids):
+        '''Returns a dict mapping each of the ids that exists to the type of
+           that question'''
+        ids = list(ids)
+        types = {}
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(ids), db.MAX_PARAMS):
+                chunk = ids[start:start + db.MAX_PARAMS]
+                cursor.execute(f"SELECT id, type FROM Question WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                types.update((row['id'], row['type']) for row in cursor)
+        return types
+
+    @staticmethod
+    def findDocument(id):
+        '''Returns the JSON representation of the question with the specified
+           id, reading the question together with its options or rubrics in a
+           single query. Exception raised if there is no such question.'''
+
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""SELECT Question.id, Question.type, Question.question_text, Question.points,
+                                     Question.setup, Question.answer,
+                                     MCOption.id AS option_id, MCOption.is_true, MCOption.option_text,
+                                     Rubric.id AS rubric_id, Rubric.rubric_text, Rubric.points AS rubric_points
+                              FROM Question
+                              LEFT JOIN MCOption ON Question.type = 'mc' AND MCOption.qid = Question.id
+                              LEFT JOIN Rubric ON Question.type = 'sa' AND Rubric.qid = Question.id
+                              WHERE Question.id = ?
+                              ORDER BY option_id, rubric_id""", (id,))
+            rows = cursor.fetchall()
+
+        if not rows:
+            raise Exception(f'No such Question with id: {id}')
+
+        row = rows[0]
+        question = Question(row['id'], row['type'], row['question_text'], row['points'], row['setup'], row['answer'])
+        options = [MCOption(row['option_id'], bool(row['is_true']), row['option_text'], question.id)
+                   for row in rows if row['option_id'] is not None]
+        rubrics = [Rubric(row['rubric_id'], row['rubric_text'], row['rubric_points'], question.id)
+                   for row in rows if row['rubric_id'] is not None]
+        return question.jsonable(options, rubrics)
+
+    @staticmethod
+    def loadDocuments(ids, cached=True):
+        '''Returns a dict mapping each of the ids that exists to a (rev,
+           document) pair, where the document is the same dict as findDocument,
+           with one query for all the questions and one each for their options
+           and rubrics. Documents cached at the question's current rev are
+           reused and fresh ones are cached, unless cached is False, which a
+           write transaction needs since its revs aren't final until it
+           commits.'''
+        ids = list(ids)
+        documents = {}
+        questions = {}
+        if not ids:
+            return documents
+
+        with db.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM Question WHERE id IN ({', '.join('?' * len(ids))})", ids)
+            for row in cursor.fetchall():
+                entry = cache.documents.get(row['id']) if cached else None
+                if entry is not None and entry[0] == row['rev']:
+                    documents[row['id']] = entry
+                else:
+                    questions[row['id']] = (row['rev'], Question(row['id'], row['type'], row['question_text'], row['points'], row['setup'], row['answer']))
+
+            options = {id: [] for id in questions}
+            rubrics = {id: [] for id in questions}
+            if questions:
+                marks = ', '.join('?' * len(questions))
+                cursor.execute(f"SELECT * FROM MCOption WHERE qid IN ({marks}) ORDER BY id", list(questions))
+                for row in cursor:
+                    options[row['qid']].append(MCOption(row['id'], bool(row['is_true']), row['option_text'], row['qid']))
+                cursor.execute(f"SELECT * FROM Rubric WHERE qid IN ({marks}) ORDER BY id", list(questions))
+                for row in cursor:
+                    rubrics[row['qid']].append(Rubric(row['id'], row['rubric_text'], row['points'], row['qid']))
+
+        for id, (rev, question) in questions.items():
+            documents[id] = (rev, question.jsonable(options[id], rubrics[id]))
+            if cached:
+                cache.documents.put(id, documents[id])
+        return documents
+
+    @staticmethod
+    def findDocuments(ids):
+        '''Returns a dict mapping each of the ids that exists to the same dict
+           as findDocument, loaded together by loadDocuments'''
+        return {id: document for id, (rev, document) in Question.loadDocuments(ids).items()}
+
+    @staticmethod
+    def getDocument(id, rev=None):
+        '''Returns the same dict as findDocument, served from the document
+           cache if the cached copy was built at the question's current rev'''
+        try:
+            id = int(id)
+        except ValueError:
+            raise Exception(f'No such Question with id: {id}')
+        if rev is None:
+            rev = db.revision('Question', id)
+
+        entry = cache.documents.get(id)
+        if entry is not None and entry[0] == rev:
+            return entry[1]
+        document = Question.findDocument(id)
+        cache.documents.put(id, (rev, document))
+        return document
+
+    @staticmethod
+    def getRendered(id):
+        '''Returns (rev, body) for the question with the specified id, where
+           body is its document as stored pre-rendered JSON bytes, rendering
+           and storing it first if it is missing or out of date. Exception
+           raised if there is no such question.'''
+        rendered = prerender.load(id)
+        if rendered is not None and rendered[1] is None:
+            # On the writable connection, since GET routes read from
+            # read-only ones that may also be behind a snapshot
+            with db.transaction():
+                prerender.refresh([id])
+                rendered = prerender.load(id)
+        if rendered is None:
+            raise Exception(f'No such Question with id: {id}')
+        return rendered
+
     @staticmethod
     def getAllIDs():
-        mc_digest = []
-        sa_digest = []
-        sql_digest = []
-        temp = {}
+        '''Returns the mc, sa and sql digests of every question, read in one
+           ordered pass over the QuestionDigest table'''
+        digests = {'mc': [], 'sa': [], 'sql': []}
         with db.connect() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT id, SUBSTRING(question_text, 1, 40) as blurb FROM Question WHERE type='mc'")
+            cursor.execute("SELECT id, type, blurb FROM QuestionDigest ORDER BY id")
             for row in cursor:
-                temp = {'id': row['id'], 'question_start': row['blurb']}
-                mc_digest.append(temp)
-                
-            cursor.execute("SELECT id, SUBSTRING(question_text, 1, 40) as blurb FROM Question WHERE type='sa'")
-            for row in cursor:
-                temp = {'id': row['id'], 'question_start': row['blurb']}
-                sa_digest.append(temp)
-                
-            cursor.execute("SELECT id, SUBSTRING(question_text, 1, 40) as blurb FROM Question WHERE type='sql'")
-            for row in cursor:
-                temp = {'id': row['id'], 'question_start': row['blurb']}
-                sql_digest.append(temp)
+                digests[row['type']].append({'id': row['id'], 'question_start': row['blurb']})
         
-        return mc_digest, sa_digest, sql_digest
+        return digests['mc'], digests['sa'], digests['sql']
                 
 
+    @staticmethod
+    def streamIndex():
+        '''Yields the same JSON object as the question index in chunks. Each
+           type's list is written out while its digest rows are scanned.'''
+        yield '{'
+        for i, q_type in enumerate(('mc', 'sa', 'sql')):
+            yield f'{", " if i else ""}"{q_type}": '
+            yield from streaming.jsonArray("SELECT id, blurb FROM QuestionDigest WHERE type = ? ORDER BY id", (q_type,),
+                                           lambda row: {'id': row['id'], 'question_start': row['blurb']})
+        yield '}'
+
+    @staticmethod
+    def getPage(after, limit, fields, q_type=None):
+        '''Returns the page of questions with id greater than after, only
+           those of type q_type if given. Pages that only need digest fields
+           are read from QuestionDigest without touching the question text.'''
+        where, params = ('AND type = ?', (q_type,)) if q_type else ('', ())
+        if all(field in Question.DIGEST_COLUMNS for field in fields):
+            return paging.fetch('QuestionDigest', Question.DIGEST_COLUMNS, fields, after, limit, where, params)
+        return paging.fetch('Question', Question.PAGE_COLUMNS, fields, after, limit, where, params)
+
     @staticmethod
     def setupBottleRoutes(app):
         @app.get('/question')
         def getQuestionIndex():
+            etag.check(db.revision('Question'))
+            if 'ids' in request.query:
+                try:
+                    ids = [int(id) for id in request.query.get('ids').split(',') if id.strip()]
+                except ValueError:
+                    response.status = 400
+                    return "ids must be a comma separated list of question ids."
+                ids = list(dict.fromkeys(ids))
+                if (len(ids) > db.MAX_PARAMS):
+                    response.status = 400
+                    return f"At most {db.MAX_PARAMS} questions can be fetched at once."
+
+                documents = Question.findDocuments(ids)
+                return {'questions': [documents[id] for id in ids if id in documents],
+                        'missing': [id for id in ids if id not in documents]}
+
+            if paging.requested(request.query, ['type']):
+                try:
+                    after, limit, fields = paging.parse(request.query, Question.PAGE_COLUMNS, Question.DIGEST_COLUMNS)
+                    q_type = request.query.get('type')
+                    if (q_type is not None and q_type not in ('mc', 'sa', 'sql')):
+                        raise Exception(f'Question type must be sql, sa, or mc.')
+                except Exception as err:
+                    response.status = 400
+                    return err.args
+                return Question.getPage(after, limit, fields, q_type)
+
+            if streaming.requested(request.query):
+                response.content_type = 'application/json'
+                return Question.streamIndex()
+
             mc_digest, sa_digest, sql_digest = Question.getAllIDs()
             response.content_type = 'application/json'
             return {"mc": mc_digest, "sa": sa_digest, "sql": sql_digest}
             # return json.dumps(question_index)
         
+        @app.post('/question/_bulk')
+        def bulkQuestions():
+            '''Applies a JSON array, or with Content-Type application/x-ndjson
+               one JSON object per line, of question operations at once'''
+            try:
+                if (request.content_type.split(';')[0] == 'application/x-ndjson'):
+                    operations = [json.loads(line) for line in request.body if line.strip()]
+                else:
+                    operations = json.load(request.body)
+                if not isinstance(operations, list):
+                    raise Exception(f'Expected a JSON array of operations.')
+            except ValueError:
+                response.status = 400
+                return "Invalid JSON"
+            except Exception as err:
+                response.status = 400
+                return err.args
+
+            ok, results = writer.run(Question.bulkFromJSON, operations)
+            if not ok:
+                response.status = 400
+            return {'results': results}
+
         @app.get('/question/<qid>')
         def getQuestion(qid):
+            if prerender.enabled:
+                try:
+                    rev, body = Question.getRendered(int(qid))
+                except Exception:
+                    response.status = 404
+                    return f"Question {qid} not found"
+                etag.check(rev)
+                response.content_type = 'application/json'
+                return body
+
+            rev = db.revision('Question', qid)
+            if rev is not None:
+                etag.check(rev)
             try:
-                question = Question.find(qid)
+                return Question.getDocument(qid, rev)
             except Exception:
                 response.status = 404
                 return f"Question {qid} not found"
-            return question.jsonable()
         
         @app.post('/question')
         def postQuestion():
             try:
-                question = Question.createFromJSON(request.json)
+                question = writer.run(Question.createFromJSON, request.json)
             except Exception as err:
                 response.status = 400
                 return err.args
@@ -214,7 +569,7 @@ class Question:
                 return f"Question {id} to update not found"
             
             try:
-                question.updateFromJSON(request.json)
+                writer.run(question.updateFromJSON, request.json)
             except Exception as err:
                 response.status = 400
                 return err.args
@@ -230,7 +585,10 @@ class Question:
                 return f"Question {id} to delete does not exist"
 
             
-            question.delete()
+            writer.run(question.delete)
             
             response.content_type = 'application/json'
-            return json.dumps(True)
+            return serializer.dumps(True)
+
+
+prerender.build = lambda ids: Question.loadDocuments(ids, cached=False)
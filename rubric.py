@@ -1,9 +1,18 @@
+import cache
 import db
-import json
+import etag
+import paging
+import prerender
+import serializer
+import streaming
+import writer
 from bottle import response, request
 
 class Rubric:
 
+    # Columns a page of the index can be projected onto with ?fields=
+    PAGE_COLUMNS = {'id': 'id', 'rubric_text': 'rubric_text', 'points': 'points', 'qid': 'qid'}
+
     def __init__(self, id, rubric_text, points, qid):
         '''Constructor'''
         self.id = id
@@ -17,7 +26,8 @@ class Rubric:
             cursor = conn.cursor()
             cursor.execute("UPDATE Rubric SET rubric_text = ?, points = ?, qid = ? WHERE id = ?",
                                (self.rubric_text, self.points, self.qid, self.id))
-            conn.commit()
+            prerender.refresh([self.qid])
+        cache.documents.invalidate(self.qid)
         
     def updateFromJSON(self, rubric_data):
         '''Unpack JSON representation to update instance variables and then
@@ -25,8 +35,13 @@ class Rubric:
         
         self.rubric_text = rubric_data['rubric_text']
         self.points = rubric_data['points']
+        old_qid = self.qid
         self.qid = rubric_data['qid']
-        self.update()
+        with db.connect():
+            self.update()
+            prerender.refresh([old_qid])
+        # The rubric may have moved to another question, which changes both
+        cache.documents.invalidate(old_qid)
 
     def delete(self):
         '''Deletes instance from database, any object representations of the
@@ -34,6 +49,8 @@ class Rubric:
         with db.connect() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM Rubric WHERE id = ?", (self.id, ))
+            prerender.refresh([self.qid])
+        cache.documents.invalidate(self.qid)
 
     
     def jsonable(self):
@@ -58,7 +75,8 @@ class Rubric:
             cursor = conn.cursor()
             cursor.execute("INSERT INTO Rubric (rubric_text, points, qid) VALUES (?, ?, ?)",
                                (rubric_text, points, qid))
-            conn.commit()
+            prerender.refresh([qid])
+        cache.documents.invalidate(qid)
         return Rubric.find(cursor.lastrowid)
 
     @staticmethod
@@ -80,20 +98,42 @@ class Rubric:
     def getAllIDs():        
         with db.connect() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT id FROM Rubric")
+            cursor.execute("SELECT id FROM Rubric ORDER BY id")
             all_ids = [row['id'] for row in cursor]
         return all_ids
         
+    @staticmethod
+    def getPage(after, limit, fields):
+        '''Returns the page of Rubric rows with id greater than after'''
+        page = paging.fetch('Rubric', Rubric.PAGE_COLUMNS, fields, after, limit)
+        return page
+
     @staticmethod
     def setupBottleRoutes(app):
         @app.get('/rubric')
         def getRubricIndex():
+            etag.check(db.revision('Rubric'))
+            if paging.requested(request.query):
+                try:
+                    after, limit, fields = paging.parse(request.query, Rubric.PAGE_COLUMNS, ['id'])
+                except Exception as err:
+                    response.status = 400
+                    return err.args
+                return Rubric.getPage(after, limit, fields)
+
+            if streaming.requested(request.query):
+                response.content_type = 'application/json'
+                return streaming.jsonArray("SELECT id FROM Rubric ORDER BY id", (), lambda row: row['id'])
+
             rubric_index = Rubric.getAllIDs()
             response.content_type = 'application/json'
-            return json.dumps(rubric_index)
+            return serializer.dumps(rubric_index)
             
         @app.get('/rubric/<id>')
         def getRubric(id):
+            rev = db.revision('Rubric', id)
+            if rev is not None:
+                etag.check(rev)
             try:
                 rubric = Rubric.find(id)
             except Exception:
@@ -103,7 +143,7 @@ class Rubric:
         
         @app.post('/rubric')
         def postRubric():
-            rubric = Rubric.createFromJSON(request.json)
+            rubric = writer.run(Rubric.createFromJSON, request.json)
             return rubric.jsonable()
 
         @app.put('/rubric/<id>')
@@ -116,7 +156,7 @@ class Rubric:
                 response.status = 404
                 return f"Rubric {id} to update not found"
 
-            rubric.updateFromJSON(request.json)
+            writer.run(rubric.updateFromJSON, request.json)
             return rubric.jsonable()
 
         @app.delete('/rubric/<id>')
@@ -129,8 +169,8 @@ class Rubric:
                 response.status = 404
                 return f"Rubric {id} to delete does not exist"
 
-            rubric.delete()
+            writer.run(rubric.delete)
     
             response.content_type = 'application/json'
-            return json.dumps(True)
+            return serializer.dumps(True)
 
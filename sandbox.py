@@ -0,0 +1,330 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import re
+import resource
+import signal
+import sqlite3
+import threading
+import time
+import cache
+
+# Runs student SQL against the setup of a question, only ever in worker
+# processes, so that no query can take the server's memory or time. Each
+# worker loads a setup into its own in-memory database, read only to
+# everything run on it after that, and keeps it in an LRU cache keyed by
+# (setup id, setup rev). Queries may only read, and are stopped once they
+# run out of time or of SQLite VM instructions, or return too many rows. A
+# single function call can't be stopped that way, so workers also have a
+# memory limit, and one that doesn't answer in time is killed and replaced.
+# The result of a model answer is worked out once per (question, rev, setup
+# rev) and kept.
+#
+# The workers run any task of a prepare and a check function, which is how
+# short answers, matched against rubric patterns from staff, are kept out
+# of the server too.
+
+# Seconds a query may run
+TIMEOUT = 2.0
+# SQLite VM instructions a query may run, checked every PROGRESS_STEP
+INSTRUCTIONS = 50_000_000
+PROGRESS_STEP = 10_000
+MAX_ROWS = 10_000
+# Longest string or blob a query may build, where sqlite3 can set it
+MAX_LENGTH = 1_000_000
+# Submissions of one question handed to a worker at a time
+CHUNK_SIZE = 50
+WORKERS = 2
+# Bytes of memory a worker may use beyond what it starts with
+MEMORY = 256 * 1024 * 1024
+# Seconds past TIMEOUT a worker gets to send a result before it is killed,
+# and seconds it gets to load a setup and run the model answer
+GRACE = 1.0
+SETUP_TIMEOUT = 10.0
+
+# What a query is allowed to do, as sqlite3 authorizer action codes
+ALLOWED = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, getattr(sqlite3, 'SQLITE_RECURSIVE', 33)}
+# Functions that can allocate any amount of memory in one call
+DENIED_FUNCTIONS = {'randomblob', 'zeroblob', 'load_extension'}
+
+sandboxes = cache.LRUCache(maxsize=64)
+answers = cache.LRUCache(maxsize=1024)
+
+
+def _authorize(action, arg1, arg2, db_name, trigger):
+    if action not in ALLOWED:
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_FUNCTION and arg2.lower() in DENIED_FUNCTIONS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+class Sandbox:
+    '''An in-memory database holding what the setup script creates, which
+       only runs queries that read it'''
+
+    def __init__(self, setup_text):
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+        self.conn.executescript(setup_text)
+        self.conn.execute("PRAGMA query_only = ON")
+        self.conn.set_authorizer(_authorize)
+        if hasattr(self.conn, 'setlimit'):
+            self.conn.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, MAX_LENGTH)
+        self._lock = threading.Lock()
+
+    def run(self, sql, timeout=TIMEOUT, instructions=INSTRUCTIONS, max_rows=MAX_ROWS):
+        '''Returns (column count, rows) of the query. sqlite3.Error raised if
+           it fails, isn't allowed or runs out of time or instructions, and
+           Exception if it returns more than max_rows rows.'''
+        deadline = time.monotonic() + timeout
+        steps = [instructions // PROGRESS_STEP]
+
+        def progress():
+            steps[0] -= 1
+            return steps[0] < 0 or time.monotonic() > deadline
+
+        with self._lock:
+            self.conn.set_progress_handler(progress, PROGRESS_STEP)
+            try:
+                cursor = self.conn.execute(sql)
+                rows = cursor.fetchmany(max_rows + 1)
+                columns = len(cursor.description or ())
+                cursor.close()
+            except sqlite3.OperationalError as err:
+                if str(err) == 'interrupted':
+                    raise sqlite3.OperationalError('The query ran out of time.') from None
+                raise
+            finally:
+                self.conn.set_progress_handler(None, 0)
+        if len(rows) > max_rows:
+            raise Exception(f'The query returns more than {max_rows} rows.')
+        return columns, rows
+
+
+def ordered(sql):
+    '''True if the query sorts its result, i.e. has an ORDER BY outside of
+       any parentheses, string or comment'''
+    sql = re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", ' ', sql, flags=re.S)
+    depth = 0
+    for token in re.finditer(r'\(|\)|\border\s+by\b', sql, re.I):
+        if token.group() == '(':
+            depth += 1
+        elif token.group() == ')':
+            depth -= 1
+        elif depth == 0:
+            return True
+    return False
+
+
+class Expected:
+    '''The result of a model answer, compared to a student's in row order if
+       the model answer sorts it and as a multiset of rows otherwise'''
+
+    def __init__(self, answer, columns, rows):
+        self.ordered = ordered(answer)
+        self.columns = columns
+        self.rows = rows if self.ordered else collections.Counter(rows)
+
+    def matches(self, columns, rows):
+        if columns != self.columns:
+            return False
+        return rows == self.rows if self.ordered else collections.Counter(rows) == self.rows
+
+
+def sandbox(setup_key, setup_text):
+    '''Returns the sandbox of the setup, (id, rev) being its setup_key'''
+    box = sandboxes.get(setup_key)
+    if box is None:
+        box = Sandbox(setup_text)
+        sandboxes.put(setup_key, box)
+    return box
+
+
+def prepareSQL(setup_key, setup_text, answer_key, answer):
+    '''Returns the sandbox of a setup and the Expected result of a model
+       answer in it, (id, rev) being the setup_key of the setup and
+       (question id, rev, setup rev) the answer_key of the model answer'''
+    box = sandbox(setup_key, setup_text)
+    expected = answers.get(answer_key)
+    if expected is None:
+        expected = Expected(answer, *box.run(answer))
+        answers.put(answer_key, expected)
+    return box, expected
+
+
+def checkSQL(prepared, query):
+    '''Runs a student query in what prepareSQL returned and says whether
+       it gives the expected result'''
+    box, expected = prepared
+    return {'correct': expected.matches(*box.run(query))}
+
+
+def ready(value):
+    '''The prepare of a task whose argument is sent ready to use'''
+    return value
+
+
+def _serve(conn):
+    '''Body of a worker process. A task is (prepare, args, check, items),
+       prepare and check being functions of a module the worker has too.
+       For each task it receives on conn, it calls prepare(*args) and sends
+       back None, or the error that keeps the items from being graded, then
+       check(prepared, item) for each of the items as soon as it has it.'''
+    # Handlers inherited from the server, such as gunicorn's, would keep
+    # the worker from stopping when its parent terminates it
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _limitMemory()
+    parent = os.getppid()
+    while True:
+        # Workers forked later hold the other end of the pipe too, so the
+        # parent going away doesn't always show up as EOF
+        while not conn.poll(1.0):
+            if os.getppid() != parent:
+                return
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        prepare, args, check, items = task
+        try:
+            prepared = prepare(*args)
+        except Exception as err:
+            conn.send(f'The question can not be graded: {err}')
+            continue
+        conn.send(None)
+        for item in items:
+            try:
+                conn.send(check(prepared, item))
+            except MemoryError:
+                conn.send({'error': 'Grading it ran out of memory.'})
+            except Exception as err:
+                conn.send({'error': str(err)})
+
+
+def _limitMemory():
+    '''Caps the address space of this process at MEMORY bytes more than it
+       uses now, so a query can't take the memory of the server'''
+    with open('/proc/self/statm') as statm:
+        used = int(statm.read().split()[0]) * resource.getpagesize()
+    resource.setrlimit(resource.RLIMIT_AS, (used + MEMORY, used + MEMORY))
+
+
+class Worker:
+    '''A worker process and the end of its pipe, which the grading threads
+       take turns using'''
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, args=(child,), name='sql-grader', daemon=True)
+        self.process.start()
+        child.close()
+
+    def _receive(self, timeout):
+        if not self.conn.poll(timeout):
+            raise TimeoutError('Grading it ran out of time.')
+        try:
+            return self.conn.recv()
+        except EOFError:
+            raise TimeoutError('Grading it stopped the process running it.') from None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def grade(self, prepare, args, check, items):
+        '''Returns the result of each of the items, as _serve sends them.
+           If the process doesn't come back with one in time, or dies, it is
+           killed and replaced, and the rest of the items are sent again.'''
+        results = []
+        while len(results) < len(items):
+            try:
+                self.conn.send((prepare, args, check, items[len(results):]))
+            except OSError:
+                # It died since its last task
+                self.restart()
+                continue
+            try:
+                error = self._receive(SETUP_TIMEOUT)
+            except TimeoutError:
+                self.restart()
+                error = 'The question can not be graded: preparing it ran out of time.'
+            if error is not None:
+                return results + [{'error': error}] * (len(items) - len(results))
+            try:
+                while len(results) < len(items):
+                    results.append(self._receive(TIMEOUT + GRACE))
+            except TimeoutError as err:
+                self.restart()
+                results.append({'error': str(err)})
+        return results
+
+    def restart(self):
+        self.kill()
+        self.start()
+
+
+workers = WORKERS
+_idle = None
+_dispatch = None
+_pid = None
+_lock = threading.Lock()
+
+
+def configure(processes=WORKERS):
+    '''Grades batches across that many worker processes, stopping the
+       current ones'''
+    global workers
+    stop()
+    workers = max(1, processes)
+
+
+def stop():
+    '''Stops the worker processes of this process'''
+    global _idle, _dispatch, _pid
+    with _lock:
+        if _pid == os.getpid():
+            _dispatch.shutdown()
+            while not _idle.empty():
+                _idle.get().kill()
+        _idle = _dispatch = _pid = None
+
+
+def _pool():
+    '''Returns the idle workers of this process and the threads handing
+       them tasks, starting them on first use, also in a forked server
+       worker, which doesn't inherit them'''
+    global _idle, _dispatch, _pid
+    with _lock:
+        if _pid != os.getpid():
+            _idle = queue.Queue()
+            for _ in range(workers):
+                _idle.put(Worker())
+            _dispatch = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='sql-grader')
+            _pid = os.getpid()
+        return _idle, _dispatch
+
+
+def _run(idle, task):
+    worker = idle.get()
+    try:
+        return worker.grade(*task)
+    finally:
+        idle.put(worker)
+
+
+def gradeAll(tasks):
+    '''Grades each of the tasks, as sent to _serve, on the worker processes
+       in parallel and returns their results in the same order'''
+    if not tasks:
+        return []
+    idle, dispatch = _pool()
+    return list(dispatch.map(lambda task: _run(idle, task), tasks))
@@ -0,0 +1,62 @@
+import db
+from bottle import response, request
+
+# Full text search over questions through the QuestionSearch FTS5 table,
+# which triggers keep up to date with every write to Question, MCOption,
+# Rubric and Setup.
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Words of context around the matched terms in a snippet
+SNIPPET_TOKENS = 12
+
+
+def matchExpression(text):
+    '''Turns what the user typed into an FTS5 query matching questions that
+       have all of its words. Every word is quoted, so FTS5 syntax in it is
+       taken literally, and a word ending in * matches as a prefix.'''
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search(text, limit=DEFAULT_LIMIT):
+    '''Returns the best matches for text, best first, each as {"id", "type",
+       "score", "snippet"} where the snippet marks the matched terms with
+       [ and ]'''
+    with db.connect() as conn:
+        cursor = conn.cursor()
+        # Only the rows that make the cut are joined and get a snippet
+        cursor.execute("""SELECT hits.id, Question.type, hits.rank, hits.snippet
+                          FROM (SELECT rowid AS id, rank,
+                                       snippet(QuestionSearch, -1, '[', ']', '...', ?) AS snippet
+                                FROM QuestionSearch
+                                WHERE QuestionSearch MATCH ?
+                                ORDER BY rank LIMIT ?) AS hits
+                          JOIN Question ON Question.id = hits.id
+                          ORDER BY hits.rank""", (SNIPPET_TOKENS, matchExpression(text), limit))
+        return [{'id': row['id'], 'type': row['type'], 'score': round(-row['rank'], 4), 'snippet': row['snippet']}
+                for row in cursor]
+
+
+def setupBottleRoutes(app):
+    @app.get('/search')
+    def getSearch():
+        '''Searches question text, answers, options, rubrics and setups'''
+        text = request.query.getunicode('q', '')
+        try:
+            limit = int(request.query.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            limit = 0
+        if not matchExpression(text):
+            response.status = 400
+            return "q must contain at least one word to search for."
+        if (limit < 1 or limit > MAX_LIMIT):
+            response.status = 400
+            return f"limit must be between 1 and {MAX_LIMIT}."
+
+        return {'results': search(text, limit)}
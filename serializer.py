@@ -0,0 +1,71 @@
+import json
+import bottle
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The JSON encoder behind every response, chosen with the json.serializer
+# config key. dumps() returns text for the streamed responses and dumpb()
+# returns the UTF-8 bytes that whole responses are sent as.
+#   compact  stdlib encoder without the spaces after , and :
+#   orjson   orjson, if it is installed
+#   stdlib   json.dumps as it is, the encoder Bottle uses out of the box
+#   pretty   stdlib encoder indented for reading, for debugging
+#   auto     orjson if it is installed, compact otherwise (the default)
+
+
+def _stdlib(**options):
+    # One encoder reused for every call, json.dumps builds a new one each
+    # time it is given any options
+    encode = json.JSONEncoder(**options).encode
+    return encode, lambda obj: encode(obj).encode()
+
+
+BACKENDS = {
+    'compact': _stdlib(separators=(',', ':')),
+    'stdlib': _stdlib(),
+    'pretty': _stdlib(indent=2),
+}
+if orjson is not None:
+    BACKENDS['orjson'] = (lambda obj: orjson.dumps(obj).decode(), orjson.dumps)
+
+name = None
+dumps = None
+dumpb = None
+
+
+def configure(backend='auto'):
+    '''Selects the encoder used from now on by name. Exception raised if
+       there is no such encoder or it isn't installed.'''
+    global name, dumps, dumpb
+    if backend == 'auto':
+        backend = 'orjson' if 'orjson' in BACKENDS else 'compact'
+    if backend not in BACKENDS:
+        raise Exception(f'JSON serializer must be one of auto, {", ".join(sorted(BACKENDS))}.')
+    name = backend
+    dumps, dumpb = BACKENDS[backend]
+
+
+configure()
+
+
+class JSONPlugin(bottle.JSONPlugin):
+    '''Bottle's JSONPlugin, encoding dict responses with the selected
+       serializer. Installing it follows the json.serializer key of the app's
+       config, also when it is changed later.'''
+
+    def __init__(self):
+        super().__init__(json_dumps=lambda obj: dumpb(obj))
+
+    def setup(self, app):
+        super().setup(app)
+        app.config._define('json.serializer', default='auto', validate=str,
+                           help="JSON encoder: auto, compact, orjson, stdlib or pretty.")
+        configure(app.config['json.serializer'])
+
+        def onChange(config, key, value):
+            if key == 'json.serializer':
+                configure(value)
+        app.config._add_change_listener(onChange)
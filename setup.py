@@ -1,9 +1,16 @@
 import db
-import json
+import etag
+import paging
+import serializer
+import streaming
+import writer
 from bottle import response, request
 
 class Setup:
 
+    # Columns a page of the index can be projected onto with ?fields=
+    PAGE_COLUMNS = {'id': 'id', 'setup_text': 'setup_text'}
+
     def __init__(self, id, setup_text):
         '''Constructor'''
         self.id = id
@@ -15,7 +22,6 @@ class Setup:
             cursor = conn.cursor()
             cursor.execute("UPDATE Setup SET setup_text = ? WHERE id = ?",
                                (self.setup_text, self.id))
-            conn.commit()
         
     def updateFromJSON(self, setup_data):
         '''Unpack JSON representation to update instance variables and then
@@ -49,7 +55,6 @@ class Setup:
             cursor = conn.cursor()
             cursor.execute("INSERT INTO Setup (setup_text) VALUES (?)",
                                (setup_text,))
-            conn.commit()
         return Setup.find(cursor.lastrowid)
 
     @staticmethod
@@ -71,20 +76,42 @@ class Setup:
     def getAllIDs():        
         with db.connect() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT id FROM Setup")
+            cursor.execute("SELECT id FROM Setup ORDER BY id")
             all_ids = [row['id'] for row in cursor]
         return all_ids
         
+    @staticmethod
+    def getPage(after, limit, fields):
+        '''Returns the page of Setup rows with id greater than after'''
+        page = paging.fetch('Setup', Setup.PAGE_COLUMNS, fields, after, limit)
+        return page
+
     @staticmethod
     def setupBottleRoutes(app):
         @app.get('/setup')
         def getSetupIndex():
+            etag.check(db.revision('Setup'))
+            if paging.requested(request.query):
+                try:
+                    after, limit, fields = paging.parse(request.query, Setup.PAGE_COLUMNS, ['id'])
+                except Exception as err:
+                    response.status = 400
+                    return err.args
+                return Setup.getPage(after, limit, fields)
+
+            if streaming.requested(request.query):
+                response.content_type = 'application/json'
+                return streaming.jsonArray("SELECT id FROM Setup ORDER BY id", (), lambda row: row['id'])
+
             setup_index = Setup.getAllIDs()
             response.content_type = 'application/json'
-            return json.dumps(setup_index)
+            return serializer.dumps(setup_index)
             
         @app.get('/setup/<id>')
         def getSetup(id):
+            rev = db.revision('Setup', id)
+            if rev is not None:
+                etag.check(rev)
             try:
                 setup = Setup.find(id)
             except Exception:
@@ -94,7 +121,7 @@ class Setup:
         
         @app.post('/setup')
         def postSetup():
-            setup = Setup.createFromJSON(request.json)
+            setup = writer.run(Setup.createFromJSON, request.json)
             return setup.jsonable()
 
         @app.put('/setup/<id>')
@@ -107,7 +134,7 @@ class Setup:
                 response.status = 404
                 return f"Setup {id} to update not found"
 
-            setup.updateFromJSON(request.json)
+            writer.run(setup.updateFromJSON, request.json)
             return setup.jsonable()
 
         @app.delete('/setup/<id>')
@@ -120,8 +147,8 @@ class Setup:
                 response.status = 404
                 return f"Setup {id} to delete does not exist"
 
-            setup.delete()
+            writer.run(setup.delete)
     
             response.content_type = 'application/json'
-            return json.dumps(True)
+            return serializer.dumps(True)
 
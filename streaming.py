@@ -0,0 +1,33 @@
+import db
+import serializer
+
+# Streaming JSON bodies for the index endpoints. The generators below are
+# returned straight from a route, so Bottle hands them to the server chunk by
+# chunk and only CHUNK_ROWS rows are ever held in memory.
+
+CHUNK_ROWS = 500
+
+
+def requested(query):
+    '''Returns True if the query string asks for a streamed response'''
+    return query.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def jsonArray(sql, params, encode):
+    '''Yields a JSON array holding encode(row) for every row sql returns. The
+       cursor keeps its own read-only connection until the array is finished.'''
+    pool = db.readers
+    conn = pool.acquire()
+    try:
+        cursor = conn.execute(sql, params)
+        yield '['
+        separator = ''
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                break
+            yield separator + ', '.join(serializer.dumps(encode(row)) for row in rows)
+            separator = ', '
+        yield ']'
+    finally:
+        pool.release(conn)
@@ -0,0 +1,125 @@
+import concurrent.futures
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import db
+
+# Optional group commit for the authoring routes. With it enabled, writes
+# are handed to a single writer thread, which runs up to batch_size of them
+# in one transaction, each inside its own SAVEPOINT, waiting at most
+# max_latency seconds after the first one for more to arrive. A burst of
+# writes then shares one commit instead of queueing on the write lock for
+# one each. The request still waits for the commit before it responds, so
+# the ids it returns are real and nothing acknowledged can be lost.
+
+MAX_LATENCY = 0.005
+BATCH_SIZE = 100
+
+
+class WriteQueue:
+    '''Runs submitted writes on one thread in grouped transactions'''
+
+    def __init__(self, max_latency=MAX_LATENCY, batch_size=BATCH_SIZE):
+        self.max_latency = max_latency
+        self.batch_size = batch_size
+        self.commits = 0
+        self.writes = 0
+        self._pending = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        '''Queues function(*args) and returns a Future of its result'''
+        future = concurrent.futures.Future()
+        self._start()
+        self._pending.put((function, args, future))
+        return future
+
+    def _start(self):
+        # Also restarts the thread in a forked worker, which doesn't inherit it
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pending = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _collect(self):
+        '''Waits for a write, then gathers the ones that follow it within
+           max_latency seconds, up to batch_size. None once stopped.'''
+        first = self._pending.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.batch_size:
+            try:
+                item = self._pending.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                self._pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            results = []
+            try:
+                with db.transaction() as conn:
+                    for function, args, future in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        conn.execute("SAVEPOINT write")
+                        try:
+                            results.append((future, function(*args), None))
+                            conn.execute("RELEASE write")
+                        except Exception as err:
+                            conn.execute("ROLLBACK TO write")
+                            conn.execute("RELEASE write")
+                            results.append((future, None, err))
+            except sqlite3.Error as err:
+                # The transaction itself failed, so none of the writes happened
+                print(f"Group commit failed: {err}", file=sys.stderr)
+                results = [(future, None, err) for function, args, future in batch if not future.cancelled()]
+            self.commits += 1
+            self.writes += len(results)
+            for future, result, err in results:
+                if err is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(err)
+
+    def stop(self):
+        '''Finishes the writes already queued and stops the writer thread'''
+        if self._thread is not None and self._pid == os.getpid():
+            self._pending.put(None)
+            self._thread.join()
+            self._pid = None
+
+
+active = None
+
+
+def configure(enable=True, max_latency=MAX_LATENCY, batch_size=BATCH_SIZE):
+    '''Turns group commit on or off, stopping the current writer thread'''
+    global active
+    if active is not None:
+        active.stop()
+    active = WriteQueue(max_latency, batch_size) if enable else None
+
+
+def run(function, *args):
+    '''Calls function(*args) and returns its result, as part of a group
+       commit on the writer thread if that is enabled'''
+    if active is None:
+        return function(*args)
+    return active.submit(function, *args).result()